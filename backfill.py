@@ -0,0 +1,167 @@
+"""
+Историческое сканирование отрезка блоков в несколько процессов:
+
+    python backfill.py --from 40000000 --to 40100000 --workers 4
+
+Отрезок режется на шарды, у каждого свой чекпоинт в backfill_shards,
+поэтому повторный запуск с теми же параметрами продолжает с места остановки.
+Транзакции пишутся с ON CONFLICT (txid) DO NOTHING - пересечение с живым
+сканером и повторы безопасны. Новые транзакции уходят тем же NOTIFY, что и
+у сканера, - API сбрасывает кэш /txs/{wallet}.
+
+Воркеры делят между собой бюджет запросов --qps (BACKFILL_QPS): у каждого
+процесса свой TokenBucket, без деления K воркеров дали бы K лимитов сразу.
+"""
+import argparse
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import List, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from db import init_db
+from logger import setup_logger
+from models import BackfillShard
+from scanner import TronScanner
+from settings import Config
+from utils.notify import notify_new_txs
+from utils.tron import TronAPI, close_sessions, rate_limiter
+
+logger = logging.getLogger('backfill')
+
+
+def split_range(start: int, end: int, shard_size: int) -> List[Tuple[int, int]]:
+    return [(s, min(s + shard_size, end)) for s in range(start, end, shard_size)]
+
+
+async def _get_checkpoint(session: AsyncSession, blockchain: str, start: int, end: int) -> BackfillShard:
+    await session.execute(insert(BackfillShard).values(
+        blockchain=blockchain, start=start, end=end, next_num=start, updated=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=['blockchain', 'start', 'end']))
+    await session.commit()
+
+    return (await session.execute(select(BackfillShard).where(
+        BackfillShard.blockchain == blockchain,
+        BackfillShard.start == start,
+        BackfillShard.end == end,
+    ))).scalar()
+
+
+async def _backfill_shard(start: int, end: int, range_size: int, qps: float) -> int:
+    rate_limiter.configure(qps)
+    # Воркеры пула сами по себе процессы - разбираем блоки в них же
+    scanner = TronScanner(parse_workers=0, fast=False)
+    blocks_done = 0
+    retries = 0
+
+    try:
+        # Свои соединения с БД и нодами в каждом процессе
+        async with init_db(create=False) as engine:
+            async with AsyncSession(bind=engine) as session:
+                shard = await _get_checkpoint(session, scanner.blockchain, start, end)
+                shard_id, block_num = shard.id, shard.next_num
+
+            async with TronAPI(Config.API_KEY) as tapi:
+                while block_num < end:
+                    try:
+                        async with AsyncSession(bind=engine) as session:
+                            await scanner.registry.refresh(session)
+
+                        blocks = await scanner._fetch_range(tapi, block_num, min(range_size, end - block_num))
+
+                        async with AsyncSession(bind=engine) as session:
+                            next_num, new_txs = await scanner._process_blocks(session, blocks, block_num)
+                            if next_num == block_num:
+                                raise RuntimeError(f'Block {block_num} not returned')
+
+                            # Чекпоинт коммитится вместе с транзакциями диапазона
+                            await session.execute(update(BackfillShard).where(BackfillShard.id == shard_id).values(
+                                next_num=next_num, updated=datetime.utcnow()))
+                            await notify_new_txs(session, Config.SCANNER_CHANNEL, new_txs)
+                            await session.commit()
+
+                        blocks_done += next_num - block_num
+                        block_num = next_num
+                        retries = 0
+                    except Exception as e:
+                        retries += 1
+                        logger.exception(f'Backfill [{start}, {end}) error at {block_num} '
+                                         f'({retries}/{Config.BACKFILL_MAX_RETRIES}): {e}')
+                        if retries >= Config.BACKFILL_MAX_RETRIES:
+                            # Чекпоинт сохранен - повторный запуск продолжит с block_num
+                            raise RuntimeError(f'Backfill [{start}, {end}) failed at {block_num}') from e
+                        await asyncio.sleep(Config.SCANNER_HEAD_SLEEP)
+    finally:
+        await close_sessions()
+
+    logger.info(f'Backfill [{start}, {end}) done: {blocks_done} blocks')
+    return blocks_done
+
+
+def _run_shard(start: int, end: int, range_size: int, qps: float) -> int:
+    return asyncio.run(_backfill_shard(start, end, range_size, qps))
+
+
+async def _prepare(end: int):
+    # Блоки за solidity-нодой не вернутся никогда - проверяем до запуска воркеров
+    try:
+        async with TronAPI(Config.API_KEY) as tapi:
+            last_block_num = await tapi.get_last_block_num()
+    finally:
+        await close_sessions()
+    if end > last_block_num + 1:
+        raise ValueError(f'--to {end} is past the last confirmed block {last_block_num}')
+
+    # Схему создаем один раз до запуска воркеров
+    async with init_db():
+        pass
+
+
+def backfill(start: int, end: int, workers: int, shard_size: int = None, range_size: int = None,
+             qps: float = None):
+    if start >= end:
+        raise ValueError(f'Empty range [{start}, {end})')
+    shards = split_range(start, end, shard_size or Config.BACKFILL_SHARD_SIZE)
+    range_size = range_size or Config.BACKFILL_RANGE_SIZE
+    # Одновременно работают не больше workers шардов - каждому своя доля
+    qps = (Config.BACKFILL_QPS if qps is None else qps) / min(workers, len(shards))
+    asyncio.run(_prepare(end))
+
+    logger.info(f'Backfill [{start}, {end}): {len(shards)} shards, {workers} workers, {qps:g} QPS each')
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_logger) as pool:
+        futures = {pool.submit(_run_shard, s, e, range_size, qps): (s, e) for s, e in shards}
+        total = 0
+        for future in as_completed(futures):
+            s, e = futures[future]
+            try:
+                total += future.result()
+            except Exception as exc:
+                logger.error(f'Shard [{s}, {e}) failed: {exc}')
+                failed.append((s, e))
+                continue
+            logger.info(f'Shard [{s}, {e}) finished, {total} blocks processed')
+
+    if failed:
+        raise RuntimeError(f'Backfill [{start}, {end}): {len(failed)} shards failed, rerun to resume: {sorted(failed)}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scan historical TRON blocks')
+
+    parser.add_argument('--from', dest='start', type=int, required=True)
+    parser.add_argument('--to', dest='end', type=int, required=True, help='exclusive')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--shard-size', type=int, default=None)
+    parser.add_argument('--range-size', type=int, default=None)
+    parser.add_argument('--qps', type=float, default=None, help='node requests per second for all workers together')
+
+    args = parser.parse_args()
+
+    setup_logger()
+    backfill(args.start, args.end, args.workers, args.shard_size, args.range_size, args.qps)
@@ -0,0 +1,47 @@
+"""
+Сравнение decode_transfer (eth_abi) и decode_trc20_transfer на записанных блоках
+
+    python -m benchmarks.bench_decoder --corpus recorded_blocks/
+"""
+import argparse
+import time
+
+from benchmarks.corpus import load_blocks, iter_trc20_calldata, synthetic_calldata
+from utils.transfer_data_decoder import decode_transfer, decode_trc20_transfer, TRANSFER_SELECTOR
+
+
+def _bench(func, calldata, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for data in calldata:
+            func(data)
+    return len(calldata) * rounds / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TRC20 calldata decoder benchmark')
+    parser.add_argument('--corpus', help='getblockbylimitnext JSON file or directory')
+    parser.add_argument('--synthetic', type=int, default=10000, help='calldata count without corpus')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.corpus:
+        calldata = list(iter_trc20_calldata(load_blocks(args.corpus)))
+    else:
+        calldata = synthetic_calldata(args.synthetic)
+
+    # eth_abi версия умеет только transfer()
+    transfers = [data for data in calldata if data[:8] == TRANSFER_SELECTOR]
+    print(f'calldata: {len(calldata)} (transfer: {len(transfers)})')
+
+    for name, func, sample in (
+        ('decode_transfer (eth_abi)', decode_transfer, transfers),
+        ('decode_trc20_transfer', decode_trc20_transfer, transfers),
+        ('decode_trc20_transfer (+transferFrom)', decode_trc20_transfer, calldata),
+    ):
+        if sample:
+            print(f'{name:<40} {_bench(func, sample, args.rounds):>12,.0f} ops/sec')
+
+
+if __name__ == '__main__':
+    main()
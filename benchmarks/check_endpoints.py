@@ -0,0 +1,109 @@
+"""
+Проверка выбора ноды в TronAPI на локальных заглушках без TronGrid,
+hedge включен. Два прогона: медленная нода 500 мс против быстрой 10 мс
+и близкие 300 мс против 120 мс, где отмененные дубли раньше путали оценки.
+
+- медленная нода после первого проигранного hedge опускается в рейтинге
+  и больше не бывает основной, остальные запросы уходят один раз на быструю;
+- отмененный дубль не записывается нодам как быстрый ответ;
+- API-ключ не уходит на ноды не из TronGrid.
+
+    python -m benchmarks.check_endpoints
+"""
+import argparse
+import asyncio
+import sys
+from collections import Counter
+
+from aiohttp import web
+
+from settings import Config
+from utils.tron import TronAPI, close_sessions, is_trongrid
+
+API_KEY = 'check-endpoints-key'
+
+
+class NodeStub:
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.requests = 0
+        self.completed = 0
+        self.api_keys = Counter()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.api_keys[request.headers.get('TRON-PRO-API-KEY')] += 1
+        await asyncio.sleep(self.delay)
+        self.completed += 1
+        return web.Response(body=b'{"block": []}', content_type='application/json')
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/walletsolidity/getblockbylimitnext', self.handle)
+        return app
+
+
+async def _serve(stub: NodeStub, port: int) -> web.AppRunner:
+    runner = web.AppRunner(stub.app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', port).start()
+    return runner
+
+
+async def check(calls: int, slow_delay: float, fast_delay: float, slow_port: int, fast_port: int) -> list:
+    slow, fast = NodeStub(slow_delay), NodeStub(fast_delay)
+    runners = [await _serve(slow, slow_port), await _serve(fast, fast_port)]
+    ranks = []
+    try:
+        # Медленная нода первая в списке - при равных оценках она основная
+        tapi = TronAPI(API_KEY, endpoints=[f'http://127.0.0.1:{slow_port}', f'http://127.0.0.1:{fast_port}'],
+                       hedge=True)
+        slow_endpoint, fast_endpoint = tapi.endpoints
+        for _ in range(calls):
+            await tapi.get_blocks_raw(1, 1)
+            ranks.append(min(tapi.endpoints, key=lambda e: e.score) is fast_endpoint)
+        # Даем отмененным запросам дойти до заглушки
+        await asyncio.sleep(slow_delay + 0.1)
+    finally:
+        await close_sessions()
+        for runner in runners:
+            await runner.cleanup()
+
+    name = f'{int(slow_delay * 1000)}ms vs {int(fast_delay * 1000)}ms'
+    print(f'[{name}] slow: {slow.requests} requests, {slow.completed} completed, {slow_endpoint}')
+    print(f'[{name}] fast: {fast.requests} requests, {fast.completed} completed, {fast_endpoint}')
+
+    return [
+        (f'[{name}] slow node ranks below fast after every call', all(ranks)),
+        (f'[{name}] slow node scored at least hedge delay + fast response', slow_endpoint.latency >= fast_delay + Config.TRON_HEDGE_DELAY),
+        (f'[{name}] fast node latency is its real delay', fast_endpoint.latency < slow_delay),
+        (f'[{name}] no responses counted for cancelled attempts', slow_endpoint.requests == 0),
+        (f'[{name}] no API key sent to non-TronGrid nodes', set(slow.api_keys) | set(fast.api_keys) == {None}),
+    ]
+
+
+async def check_all(calls: int, port: int) -> bool:
+    checks = [
+        ('API key goes to TronGrid hosts', is_trongrid('https://api.trongrid.io')
+         and is_trongrid('https://nile.trongrid.io/')),
+        ('no API key for look-alike hosts', not is_trongrid('https://trongrid.io.example.com')
+         and not is_trongrid('https://eviltrongrid.io')),
+    ]
+    # Статистика нод общая на процесс - у каждого прогона свои порты
+    checks += await check(calls, 0.5, 0.01, port, port + 1)
+    checks += await check(calls, 0.3, 0.12, port + 2, port + 3)
+    for name, ok in checks:
+        print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    return all(ok for _, ok in checks)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check TronAPI endpoint scoring and hedging on local stubs')
+    parser.add_argument('--calls', type=int, default=10)
+    parser.add_argument('--port', type=int, default=18091, help='first of 4 consecutive ports for stubs')
+    args = parser.parse_args()
+
+    # Hedge через 50 мс, пока у ноды нет своей статистики p95
+    Config.TRON_HEDGE_DELAY = 0.05
+    sys.exit(0 if asyncio.run(check_all(args.calls, args.port)) else 1)
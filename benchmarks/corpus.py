@@ -0,0 +1,124 @@
+import json
+import os
+from pathlib import Path
+from typing import Iterator, List
+
+from utils.transfer_data_decoder import TRANSFER_SELECTOR, TRANSFER_FROM_SELECTOR
+
+
+def iter_corpus_files(path: str) -> Iterator[Path]:
+    """
+    Записанные ответы getblockbylimitnext: один файл или папка с *.json
+    """
+    path = Path(path)
+    if path.is_file():
+        yield path
+        return
+    yield from sorted(path.glob('*.json'))
+
+
+def load_blocks(path: str) -> List[dict]:
+    blocks = []
+    for file in iter_corpus_files(path):
+        with open(file, 'rb') as f:
+            blocks.extend(json.load(f).get('block') or [])
+    return blocks
+
+
+def iter_trc20_calldata(blocks: List[dict]) -> Iterator[str]:
+    for block in blocks:
+        for tx in block.get('transactions') or []:
+            contr = tx['raw_data']['contract'][0]
+            if contr['type'] != 'TriggerSmartContract':
+                continue
+            data = contr['parameter']['value'].get('data', '')
+            if data[:8] in (TRANSFER_SELECTOR, TRANSFER_FROM_SELECTOR):
+                yield data
+
+
+def synthetic_calldata(count: int) -> List[str]:
+    """
+    Если корпуса нет - случайные transfer() с разными получателями
+    """
+    return [
+        TRANSFER_SELECTOR + '0' * 24 + os.urandom(20).hex() + int.from_bytes(os.urandom(8), 'big').to_bytes(32, 'big').hex()
+        for _ in range(count)
+    ]
+
+
+def load_responses(path: str) -> List[bytes]:
+    """
+    Ответы как есть, байтами - в таком виде их получает сканер
+    """
+    responses = []
+    for file in iter_corpus_files(path):
+        with open(file, 'rb') as f:
+            responses.append(f.read())
+    return responses
+
+
+def iter_recipients(blocks: List[dict]) -> Iterator[bytes]:
+    """
+    Сырые адреса получателей TRX и TRC20 переводов корпуса
+    """
+    for block in blocks:
+        for tx in block.get('transactions') or []:
+            contr = tx['raw_data']['contract'][0]
+            value = contr['parameter']['value']
+            if contr['type'] == 'TransferContract' and value.get('to_address'):
+                yield bytes.fromhex(value['to_address'])
+            elif contr['type'] == 'TriggerSmartContract':
+                data = value.get('data', '')
+                if data[:8] == TRANSFER_SELECTOR and len(data) >= 72:
+                    yield bytes.fromhex('41' + data[32:72])
+                elif data[:8] == TRANSFER_FROM_SELECTOR and len(data) >= 136:
+                    yield bytes.fromhex('41' + data[96:136])
+
+
+def random_address() -> bytes:
+    return b'\x41' + os.urandom(20)
+
+
+def synthetic_blocks(count: int, txs_per_block: int, contract: bytes, start: int = 1,
+                     recipients: int = 10000) -> List[dict]:
+    """
+    Блоки в формате getblockbylimitnext: примерно поровну TRX и TRC20 переводов
+    на contract плюс вызовы других контрактов
+    """
+    pool = [random_address().hex() for _ in range(recipients)]
+    other = random_address().hex()
+    blocks = []
+    for num in range(start, start + count):
+        txs = []
+        for i in range(txs_per_block):
+            to = pool[int.from_bytes(os.urandom(4), 'big') % recipients]
+            kind = i % 5
+            if kind < 2:
+                contr = {'type': 'TransferContract', 'parameter': {'value': {
+                    'amount': 1000000 + i, 'owner_address': other, 'to_address': to}}}
+            else:
+                data = TRANSFER_SELECTOR + '0' * 24 + to[2:] + (1000000 + i).to_bytes(32, 'big').hex()
+                contr = {'type': 'TriggerSmartContract', 'parameter': {'value': {
+                    'data': data, 'owner_address': other,
+                    'contract_address': contract.hex() if kind < 4 else other}}}
+            txs.append({
+                'ret': [{'contractRet': 'SUCCESS'}],
+                'signature': ['00' * 65],
+                'txID': os.urandom(32).hex(),
+                'raw_data': {'contract': [contr], 'timestamp': 1700000000000 + num * 3000},
+                'raw_data_hex': '00' * 200,
+            })
+        blocks.append({
+            'blockID': num.to_bytes(8, 'big').hex() + os.urandom(24).hex(),
+            'block_header': {'raw_data': {'number': num, 'parentHash': os.urandom(32).hex(),
+                                          'timestamp': 1700000000000 + num * 3000}},
+            'transactions': txs,
+        })
+    return blocks
+
+
+def to_responses(blocks: List[dict], range_size: int) -> List[bytes]:
+    return [
+        json.dumps({'block': blocks[i:i + range_size]}).encode()
+        for i in range(0, len(blocks), range_size)
+    ]
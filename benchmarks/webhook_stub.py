@@ -0,0 +1,79 @@
+"""
+Локальный получатель вебхуков для проверки WebhookDispatcher: проверяет
+подпись, считает повторы по Idempotency-Key и может отвечать ошибками,
+чтобы проверить повторы с задержкой: случайно (--fail-rate) или первые
+N запросов по каждому ключу (--fail-first).
+
+    python -m benchmarks.webhook_stub --port 8081 --secret test --fail-rate 0.2
+    WEBHOOK_URL=http://localhost:8081/ WEBHOOK_SECRET=test python scanner.py
+"""
+import argparse
+import hmac
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+from utils.webhooks import sign
+
+
+class WebhookStub:
+
+    def __init__(self, secret: str = '', fail_rate: float = 0.0, fail_first: int = 0):
+        self.secret = secret
+        self.fail_rate = fail_rate
+        self.fail_first = fail_first
+        self.attempts = Counter()
+        self.received = {}
+        self.duplicates = 0
+        self.bad_signatures = 0
+        self.failed = 0
+        self.started = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if self.secret:
+            expected = sign(self.secret, request.headers.get('X-Webhook-Timestamp', ''), body)
+            if not hmac.compare_digest(expected, request.headers.get('X-Webhook-Signature', '')):
+                self.bad_signatures += 1
+                return web.Response(status=401)
+
+        key = request.headers.get('Idempotency-Key')
+        self.attempts[key] += 1
+        if self.attempts[key] <= self.fail_first or random.random() < self.fail_rate:
+            self.failed += 1
+            return web.Response(status=503)
+
+        self.started = self.started or time.monotonic()
+        if key in self.received:
+            self.duplicates += 1
+        self.received[key] = body
+        return web.Response(status=204)
+
+    async def stats(self, request: web.Request) -> web.Response:
+        elapsed = time.monotonic() - self.started if self.started else 0
+        return web.json_response({
+            'received': len(self.received),
+            'duplicates': self.duplicates,
+            'bad_signatures': self.bad_signatures,
+            'failed': self.failed,
+            'per_sec': round(len(self.received) / elapsed, 1) if elapsed else None,
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/', self.handle)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local webhook receiver')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--secret', default='')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with 503')
+    parser.add_argument('--fail-first', type=int, default=0, help='first N requests per key answered with 503')
+    args = parser.parse_args()
+
+    web.run_app(WebhookStub(args.secret, args.fail_rate, args.fail_first).app(), port=args.port)
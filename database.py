@@ -2,4 +2,8 @@ from sqlalchemy.ext.asyncio import create_async_engine
 from settings import Config
 
 
-engine = create_async_engine(Config.DB_URL)
\ No newline at end of file
+engine = create_async_engine(
+    Config.DB_URL,
+    pool_size=Config.API_DB_POOL_SIZE,
+    max_overflow=Config.API_DB_MAX_OVERFLOW,
+)
@@ -1,10 +1,30 @@
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine
 from contextlib import asynccontextmanager
 import models
 
 
+# create_all не трогает уже существующие таблицы - досоздаем то, что добавилось позже
+UPGRADE_STATEMENTS = [
+    'CREATE INDEX IF NOT EXISTS ix_wallets_updated ON wallets (updated)',
+    'CREATE INDEX IF NOT EXISTS ix_transactions_to_address_time ON transactions (to_address, time DESC, id DESC)',
+    'CREATE INDEX IF NOT EXISTS ix_transactions_currency_name ON transactions (currency_name)',
+    'ALTER TABLE block_cursor ADD COLUMN IF NOT EXISTS head BIGINT',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_wallet_balances_wallet_currency ON wallet_balances (wallet_id, currency_name)',
+    'ALTER TABLE transactions ADD COLUMN IF NOT EXISTS block_hash VARCHAR(64)',
+    'DROP INDEX IF EXISTS ix_transactions_pending_block_hash',
+    "CREATE INDEX IF NOT EXISTS ix_transactions_unconfirmed_block_hash ON transactions (block_hash) "
+    "WHERE status IN ('pending', 'failed')",
+]
+
+
+def _upgrade_schema(conn):
+    for stmt in UPGRADE_STATEMENTS:
+        conn.execute(text(stmt))
+
+
 @asynccontextmanager
-async def init_db():
+async def init_db(create: bool = True):
     from settings import Config
     db_name = Config.DB_NAME
     db_user = Config.DB_USER
@@ -14,10 +34,16 @@ async def init_db():
     if not all([db_host, db_user, db_name]):
         raise RuntimeError('You have to set DB_NAME DB_USER DB_PASSWORD DB_HOST in config')
 
-    engine = create_async_engine(f'postgresql+asyncpg://{db_user}:{db_password}@{db_host}/{db_name}')
+    engine = create_async_engine(
+        f'postgresql+asyncpg://{db_user}:{db_password}@{db_host}/{db_name}',
+        pool_size=Config.SCANNER_DB_POOL_SIZE,
+        max_overflow=Config.SCANNER_DB_MAX_OVERFLOW,
+    )
 
-    async with engine.begin() as conn:
-        await conn.run_sync(models.Base.metadata.create_all)
+    if create:
+        async with engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+            await conn.run_sync(_upgrade_schema)
 
     try:
         yield engine
@@ -1,22 +1,165 @@
-import os
+"""
+Загрузка отслеживаемых кошельков.
+
+Файлы читаются потоково кусками по --chunk-size адресов: кусок проверяется,
+через COPY попадает во временную таблицу и переносится в wallets одним
+INSERT ... ON CONFLICT DO NOTHING. Память не зависит от размера файла.
+
+    python load_to_db.py                                  # tron_wallets.csv
+    python load_to_db.py tron_wallets.csv wallets_json.json --chunk-size 50000
+"""
+import argparse
 import asyncio
 import csv
-from uuid import uuid4
+import json
+import logging
+import time
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
 
+import asyncpg
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from tronpy.keys import to_base58check_address
 
 from db import init_db
-from models import Wallet, Currency, Token, Block
+from logger import setup_logger
+from models import Currency, Token
 from settings.base import BaseConfig
+from utils.common import address_to_raw
 
+logger = logging.getLogger(__name__)
 
-currencies = [('TRX', 6), ('USDT', 6)]
 
-async def _load_to_db(wallets):
-    async with init_db() as engine:
-        session = AsyncSession(bind=engine)
+currencies = [('TRX', 6), ('USDT', 6)]
 
+CHUNK_SIZE = 10000
+READ_SIZE = 1 << 16
+
+STAGE_TABLE = 'wallets_stage'
+
+
+def iter_csv_addresses(path: str) -> Iterator[str]:
+    with open(path, newline='') as csvfile:
+        for row in csv.reader(csvfile, delimiter=' ', quotechar='|'):
+            if row:
+                yield row[0]
+
+
+def iter_json_array(path: str, read_size: int = READ_SIZE) -> Iterator:
+    """
+    Элементы JSON-массива по одному, не загружая файл целиком
+    """
+    decoder = json.JSONDecoder()
+    with open(path, encoding='utf-8') as f:
+        buf, pos = '', 0
+        started = eof = False
+        while True:
+            # пропускаем пробелы, а внутри массива и запятые
+            while pos < len(buf) and buf[pos] in (' \t\r\n,' if started else ' \t\r\n'):
+                pos += 1
+
+            if pos < len(buf):
+                if not started:
+                    if buf[pos] != '[':
+                        raise ValueError(f'{path}: JSON array expected')
+                    started = True
+                    pos += 1
+                    continue
+                if buf[pos] == ']':
+                    return
+                try:
+                    item, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    # Элемент не влез в буфер целиком - дочитываем
+                    if eof:
+                        raise
+                else:
+                    # Число на границе буфера могло обрезаться - тоже дочитываем
+                    if end < len(buf) or eof:
+                        yield item
+                        pos = end
+                        continue
+            elif eof:
+                raise ValueError(f'{path}: unexpected end of JSON array')
+
+            chunk = f.read(read_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+
+def iter_json_addresses(path: str, blockchain: str = 'TRON') -> Iterator[str]:
+    for wallet in iter_json_array(path):
+        if isinstance(wallet, dict) and wallet.get('blockchain', blockchain) == blockchain \
+                and isinstance(wallet.get('address'), str):
+            yield wallet['address']
+
+
+def iter_file_addresses(path: str) -> Iterator[str]:
+    if path.endswith('.json'):
+        return iter_json_addresses(path)
+    return iter_csv_addresses(path)
+
+
+def normalize_addresses(addresses: Iterable[str], invalid: Optional[list] = None) -> List[str]:
+    """
+    Приводит адреса к base58, невалидные складывает в invalid
+    """
+    ret = []
+    for address in addresses:
+        raw = address_to_raw(address.strip())
+        if raw is None:
+            if invalid is not None:
+                invalid.append(address)
+            continue
+        ret.append(to_base58check_address(raw))
+    return ret
+
+
+async def import_wallets(conn: asyncpg.Connection, addresses: Iterable[str], chunk_size: int = CHUNK_SIZE,
+                         invalid_addresses: Optional[list] = None) -> dict:
+    """
+    COPY во временную таблицу + INSERT ... ON CONFLICT DO NOTHING, кусок - одна транзакция.
+    updated ставим сразу - по нему WalletRegistry сканера догружает новые кошельки
+    """
+    await conn.execute(f'CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE} (address VARCHAR(64))')
+
+    stats = {'read': 0, 'invalid': 0, 'inserted': 0}
+    started = time.monotonic()
+    addresses = iter(addresses)
+    while True:
+        chunk = list(islice(addresses, chunk_size))
+        if not chunk:
+            break
+
+        invalid = []
+        valid = normalize_addresses(chunk, invalid)
+        if invalid_addresses is not None:
+            invalid_addresses.extend(invalid)
+        if invalid:
+            logger.warning(f'Invalid addresses: {", ".join(invalid[:10])}{" ..." if len(invalid) > 10 else ""}')
+
+        async with conn.transaction():
+            await conn.execute(f'TRUNCATE {STAGE_TABLE}')
+            await conn.copy_records_to_table(STAGE_TABLE, records=[(a,) for a in valid], columns=['address'])
+            status = await conn.execute(f'''
+                INSERT INTO wallets (address, created, updated)
+                SELECT DISTINCT address, timezone('utc', now()), timezone('utc', now()) FROM {STAGE_TABLE}
+                ON CONFLICT (address) DO NOTHING
+            ''')
+
+        stats['read'] += len(chunk)
+        stats['invalid'] += len(invalid)
+        stats['inserted'] += int(status.split()[-1])
+        elapsed = time.monotonic() - started
+        logger.info(f"Wallets: read {stats['read']}, inserted {stats['inserted']}, invalid {stats['invalid']} "
+                    f"({stats['read'] / elapsed if elapsed else 0:.0f} addr/s)")
+
+    return stats
+
+
+async def _seed_currencies(engine):
+    async with AsyncSession(bind=engine) as session:
         c = (await session.execute(select(Currency).where(Currency.name == 'USDT'))).scalar()
         if not c:
             c = Currency(name='USDT', decimals=6)
@@ -28,29 +171,33 @@ async def _load_to_db(wallets):
 
         session.add(t)
         session.add(c)
-        for a in wallets:
-            if (await session.execute(select(Wallet).where(Wallet.address == a))).scalar():
-                continue
-
-            session.add(Wallet(address=a))
 
         for name, d in currencies:
             if not (await session.execute(select(Currency).where(Currency.name == name))).scalar():
                 session.add(Currency(name=name, decimals=d))
 
         await session.commit()
-        await session.close()
 
 
-if __name__ == '__main__':
-    import csv
+async def _load_to_db(paths: List[str], chunk_size: int):
+    async with init_db() as engine:
+        await _seed_currencies(engine)
 
-    wallets = [ ]
-    with open('tron_wallets.csv', newline='') as csvfile:
+    conn = await asyncpg.connect(BaseConfig.DB_DSN)
+    try:
+        for path in paths:
+            logger.info(f'Importing {path}')
+            stats = await import_wallets(conn, iter_file_addresses(path), chunk_size)
+            logger.info(f'{path}: {stats}')
+    finally:
+        await conn.close()
 
-        spamreader = csv.reader(csvfile, delimiter=' ', quotechar='|')
 
-        for row in spamreader:
-            wallets.append(row[0])
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import watched wallets from CSV or JSON')
+    parser.add_argument('paths', nargs='*', default=['tron_wallets.csv'], help='*.csv (address per row) or *.json')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
 
-    asyncio.run(_load_to_db(wallets))
+    setup_logger()
+    asyncio.run(_load_to_db(args.paths, args.chunk_size))
@@ -3,10 +3,21 @@ from pathlib import Path
 
 from yaml import safe_load
 
+from settings import Config
+from utils.logs import start_background_logging, stop_background_logging
+
 
 def setup_logger():
     here = Path(__file__).parent
     with open(here / 'logger.yaml', 'r') as f:
         config = safe_load(f.read())
-        dictConfig(config)
 
+    if Config.LOG_FORMAT == 'json':
+        for logger in [config['root'], *config['loggers'].values()]:
+            logger['handlers'] = [config['json_handlers'].get(h, h) for h in logger['handlers']]
+
+    # Старые обработчики закрывает dictConfig - сначала дописываем очереди
+    stop_background_logging()
+    dictConfig(config)
+    # Запись в файл и stdout идет в фоновом потоке, не в event loop
+    start_background_logging('', *config['loggers'])
@@ -1,12 +1,28 @@
 import asyncio
-from fastapi import FastAPI
+import hashlib
+import hmac
+import json
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 import uvicorn
+from pydantic import BaseModel
 from settings import Config
 from database import engine
 from scanner import TronScanner
+from utils.tron import close_sessions
 from sqlalchemy.ext.asyncio import AsyncSession
-from models import Transaction
-from sqlalchemy import select, func
+from models import BlockCursor, Transaction
+from sqlalchemy import and_, or_, select, tuple_
+from tronpy.keys import to_base58check_address
+from utils.cache import WalletCache
+from utils.broker import DepositBroker, SubscriberOverflow
+from utils.common import address_to_raw
+from utils import metrics
+from utils.notify import ScannerChannel
+from load_to_db import import_wallets
 
 def get_app() -> FastAPI:
     fast_api = FastAPI()
@@ -16,64 +32,321 @@ def get_app() -> FastAPI:
 
 app = get_app()
 
+metrics.track_pool('api', engine)
+
 
 scanner = TronScanner()
 
+wallet_cache = WalletCache(Config.WALLET_CACHE_SIZE, Config.WALLET_CACHE_TTL)
+
+# Только нужные колонки, без ORM-объектов
+TX_COLUMNS = (
+    Transaction.id,
+    Transaction.contract_address,
+    Transaction.block_num,
+    Transaction.txid,
+    Transaction.from_address,
+    Transaction.to_address,
+    Transaction.time,
+    Transaction.currency_name,
+    Transaction.purpose,
+    Transaction.status,
+)
+
+# Сколько строк за раз тянем из серверного курсора при выгрузке в NDJSON
+STREAM_CHUNK_SIZE = 1000
+
+
+def _tx_to_dict(t) -> dict:
+    return {
+        'id': t.id,
+        'contract_address': t.contract_address,
+        'block_num': t.block_num,
+        'txid': t.txid,
+        'from_address': t.from_address,
+        'to_address': t.to_address,
+        'time': t.time.isoformat() if t.time is not None else None,
+        'currency_name': t.currency_name,
+        # deposit / withdraw / transfer - в выдаче не только поступления
+        'purpose': t.purpose,
+        'status': t.status,
+    }
+
+
+async def _stream_txs(stmt):
+    async with engine.connect() as conn:
+        result = await conn.stream(stmt)
+        async for rows in result.partitions(STREAM_CHUNK_SIZE):
+            yield ''.join(json.dumps(_tx_to_dict(t)) + '\n' for t in rows)
+
+
+def _page(txs, response: Response, limit: int) -> list:
+    if len(txs) == limit:
+        response.headers['X-Next-After'] = str(txs[-1].id)
+
+    return [_tx_to_dict(t) for t in txs]
+
 
 @app.on_event("shutdown")
 async def shutdown():
+    await scanner_channel.stop()
+    await broker.stop()
     await engine.dispose()
+    await close_sessions()
 
 
 @app.get('/txs')
-async def get_txs():
+async def get_txs(
+        response: Response,
+        limit: int = Query(Config.API_PAGE_SIZE, ge=1, le=Config.API_MAX_PAGE_SIZE),
+        after: Optional[int] = None,
+        format: str = Query('json', regex='^(json|ndjson)$'),
+):
+    """
+    Keyset-пагинация по id: следующая страница - ?after=<X-Next-After>.
+    format=ndjson - потоковая выгрузка всего, что после after, без limit
+    """
+    stmt = select(*TX_COLUMNS).order_by(Transaction.id)
+    if after is not None:
+        stmt = stmt.where(Transaction.id > after)
+
+    if format == 'ndjson':
+        return StreamingResponse(_stream_txs(stmt), media_type='application/x-ndjson')
+
     async with AsyncSession(bind=engine) as session:
-        txs = (await session.execute(select(Transaction))).scalars().all()
+        txs = (await session.execute(stmt.limit(limit))).all()
+
+    return _page(txs, response, limit)
 
 
-    res = [
-        {
-            'contract_address': t.contract_address,
-            'block_num': t.block_num,
-            'txid': t.txid,
-            'from_address': t.from_address,
-            'to_address': t.to_address,
-            'time': t.time,
-            'currency_name': t.currency_name
+def _normalize_address(address: str, name: str) -> str:
+    """
+    base58 адреса TRON регистрозависимы - не lower(), а проверяем и приводим к base58
+    """
+    raw = address_to_raw(address)
+    if raw is None:
+        raise HTTPException(status_code=400, detail=f'Invalid {name} address: {address}')
+    return to_base58check_address(raw)
 
-        }
 
-        for t in txs
-    ]
+async def get_wallet_txs_stmt(session: AsyncSession, wallet: str, after: Optional[int] = None,
+                              from_address: Optional[str] = None, currency_name: Optional[str] = None):
+    """
+    Новые сверху, идет по индексу (to_address, time DESC, id DESC).
+    after - id последней транзакции предыдущей страницы.
+    Строки без time (старые, до заполнения из блока) идут первыми, как NULL в DESC-индексе
+    """
+    stmt = select(*TX_COLUMNS).where(Transaction.to_address == wallet)
+    if from_address is not None:
+        stmt = stmt.where(Transaction.from_address == from_address)
+    if currency_name is not None:
+        stmt = stmt.where(Transaction.currency_name == currency_name)
 
-    return res
+    if after is not None:
+        anchor = (await session.execute(
+            select(Transaction.time, Transaction.id).where(Transaction.id == after)
+        )).first()
+        if anchor is None:
+            raise HTTPException(status_code=400, detail=f'Unknown cursor: {after}')
+        if anchor.time is None:
+            # Сравнение кортежа с NULL ничего не вернет - дочитываем NULL-строки и переходим к остальным
+            stmt = stmt.where(or_(
+                and_(Transaction.time.is_(None), Transaction.id < anchor.id),
+                Transaction.time.isnot(None),
+            ))
+        else:
+            stmt = stmt.where(tuple_(Transaction.time, Transaction.id) < tuple_(anchor.time, anchor.id))
+
+    return stmt.order_by(Transaction.time.desc().nulls_first(), Transaction.id.desc())
 
 
 @app.get('/txs/{wallet}')
-async def get_txs_by_wallet(wallet: str):
+async def get_txs_by_wallet(
+        wallet: str,
+        request: Request,
+        response: Response,
+        limit: int = Query(Config.API_PAGE_SIZE, ge=1, le=Config.API_MAX_PAGE_SIZE),
+        after: Optional[int] = None,
+        from_address: Optional[str] = None,
+        currency_name: Optional[str] = None,
+        format: str = Query('json', regex='^(json|ndjson)$'),
+):
+    wallet = _normalize_address(wallet, 'wallet')
+    if from_address is not None:
+        from_address = _normalize_address(from_address, 'from_address')
+
+    if format == 'ndjson':
+        async with AsyncSession(bind=engine) as session:
+            stmt = await get_wallet_txs_stmt(session, wallet, after, from_address, currency_name)
+        return StreamingResponse(_stream_txs(stmt), media_type='application/x-ndjson')
+
+    # Бакет берем до запроса в БД: если сканер сбросит кошелек, пока мы читаем, ответ не закэшируется
+    bucket = wallet_cache.bucket(wallet)
+    key = (limit, after, from_address, currency_name)
+    page = bucket.get(key)
+    if page is None:
+        async with AsyncSession(bind=engine) as session:
+            stmt = await get_wallet_txs_stmt(session, wallet, after, from_address, currency_name)
+            txs = (await session.execute(stmt.limit(limit))).all()
+
+        items = [_tx_to_dict(t) for t in txs]
+        next_after = str(txs[-1].id) if len(txs) == limit else None
+        etag = '"%s"' % hashlib.sha1(json.dumps(items).encode()).hexdigest()
+        page = (etag, items, next_after)
+        bucket.set(key, page)
+
+    etag, items, next_after = page
+    headers = {'ETag': etag}
+    if next_after is not None:
+        headers['X-Next-After'] = next_after
+
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return items
+
+
+def _invalidate_wallets(new_txs: list):
+    for tx in new_txs:
+        wallet_cache.invalidate(tx.to_address)
+
+
+broker = DepositBroker(engine)
+
+# Новые транзакции приходят от сканера в этом же процессе или через LISTEN/NOTIFY от отдельного
+scanner.listeners.append(_invalidate_wallets)
+scanner.listeners.append(broker.publish)
+scanner_channel = ScannerChannel(Config.DB_DSN, Config.SCANNER_CHANNEL, scanner.listeners)
+
+
+def _subscribe(wallet: Optional[List[str]], currency: Optional[List[str]]):
+    wallets = [_normalize_address(w, 'wallet') for w in wallet or ()]
+    return broker.subscribe(wallets, currency)
+
+
+@app.get('/sse/deposits')
+async def sse_deposits(
+        request: Request,
+        wallet: Optional[List[str]] = Query(None),
+        currency: Optional[List[str]] = Query(None),
+        after: Optional[int] = None,
+):
+    """
+    Server-Sent Events с новыми депозитами. Переподключение продолжает
+    с Last-Event-ID (или ?after=<id>)
+    """
+    last_event_id = request.headers.get('last-event-id')
+    if after is None and last_event_id and last_event_id.isdigit():
+        after = int(last_event_id)
+    sub = _subscribe(wallet, currency)
+
+    async def stream():
+        try:
+            async for event in broker.events(sub, after, keepalive=Config.BROKER_KEEPALIVE):
+                if event is None:
+                    yield ': keepalive\n\n'
+                else:
+                    yield f"id: {event['id']}\nevent: deposit\ndata: {json.dumps(event)}\n\n"
+        except SubscriberOverflow as e:
+            yield f'event: overflow\ndata: {json.dumps(str(e))}\n\n'
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.websocket('/ws/deposits')
+async def ws_deposits(
+        websocket: WebSocket,
+        wallet: Optional[List[str]] = Query(None),
+        currency: Optional[List[str]] = Query(None),
+        after: Optional[int] = None,
+):
+    """
+    Те же события, что и /sse/deposits: {"type": "deposit", ...транзакция}.
+    При переполнении буфера соединение закрывается с кодом 1013,
+    клиент переподключается с ?after=<последний id>
+    """
+    try:
+        sub = _subscribe(wallet, currency)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+
+    await websocket.accept()
+    try:
+        async for event in broker.events(sub, after, keepalive=Config.BROKER_KEEPALIVE):
+            await websocket.send_json({'type': 'ping'} if event is None else {'type': 'deposit', **event})
+    except SubscriberOverflow as e:
+        await websocket.close(code=1013, reason=str(e))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        broker.unsubscribe(sub)
+
+
+@app.get('/health')
+async def health():
+    """
+    Прогресс сканера по block_cursor - работает и для отдельного процесса сканера
+    """
     async with AsyncSession(bind=engine) as session:
-        txs = (await session.execute(select(Transaction).where(func.lower(Transaction.to_address)==wallet.lower()))).scalars().all()
+        cursor = (await session.execute(
+            select(BlockCursor).where(BlockCursor.blockchain == scanner.blockchain)
+        )).scalar()
+
+    status = 'ok'
+    if cursor is None or (datetime.utcnow() - cursor.updated).total_seconds() > Config.SCANNER_STALE_AFTER:
+        status = 'stale'
+    if Config.SCANNER_MODE == 'embedded' and (TronScanner.TASK is None or TronScanner.TASK.done()):
+        status = 'down'
+
+    return JSONResponse(status_code=200 if status == 'ok' else 503, content={
+        'status': status,
+        'mode': Config.SCANNER_MODE,
+        'block_num': cursor.num if cursor else None,
+        'head': cursor.head if cursor else None,
+        'lag': cursor.head - cursor.num if cursor and cursor.head is not None else None,
+        'updated': cursor.updated.isoformat() if cursor else None,
+    })
 
-    res = [
-        {
-            'contract_address': t.contract_address,
-            'block_num': t.block_num,
-            'txid': t.txid,
-            'from_address': t.from_address,
-            'to_address': t.to_address,
-            'time': t.time,
-            'currency_name': t.currency_name
+class WalletsImport(BaseModel):
+    addresses: List[str]
 
-        }
 
-        for t in txs
-    ]
+@app.post('/admin/wallets')
+async def add_wallets(data: WalletsImport, x_admin_token: Optional[str] = Header(None)):
+    """
+    Добавление кошельков тем же COPY, что и load_to_db.py.
+    Без ADMIN_TOKEN в конфиге ручка выключена
+    """
+    if not Config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail='Admin API is disabled')
+    if x_admin_token is None or not hmac.compare_digest(x_admin_token, Config.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail='Invalid admin token')
+
+    invalid = []
+    async with engine.connect() as conn:
+        raw = await conn.get_raw_connection()
+        stats = await import_wallets(raw.driver_connection, data.addresses, invalid_addresses=invalid)
+
+    return {**stats, 'invalid_addresses': invalid[:100]}
+
+
+@app.get('/metrics')
+async def get_metrics():
+    data, content_type = metrics.render()
+    return Response(content=data, headers={'Content-Type': content_type})
 
-    return res
 
 @app.on_event("startup")
-async def shutdown():
-    TronScanner.TASK = asyncio.create_task(scanner._start())
+async def startup():
+    broker.start()
+    if Config.SCANNER_MODE == 'embedded':
+        TronScanner.TASK = asyncio.create_task(scanner._start())
+    else:
+        scanner_channel.start()
 
 
 
@@ -82,4 +355,4 @@ if __name__ == '__main__':
         app,
         host=Config.HOST,
         port=Config.PORT,
-    )
\ No newline at end of file
+    )
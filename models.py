@@ -7,7 +7,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy.orm import relationship, selectinload
 from sqlalchemy import Column, String, DateTime, INTEGER, ForeignKey, \
-    Numeric, BIGINT, Boolean, text
+    Numeric, BIGINT, Boolean, Index, UniqueConstraint, Text, text
 
 
 Base = declarative_base()
@@ -47,12 +47,64 @@ class BaseModel(Base):
 
 
 class Block(Base):
+    """
+    Старый журнал обработанных блоков, сканер его больше не пишет - см. BlockCursor
+    """
     __tablename__ = 'block'
 
     blockchain = Column(String(16), nullable=False)
     num = Column(BigInteger, primary_key=True)
 
 
+class BlockCursor(Base):
+    """
+    Последний обработанный блок - одна строка на блокчейн.
+    Заодно канал прогресса сканера для API: head - последний известный блок сети
+    """
+    __tablename__ = 'block_cursor'
+
+    blockchain = Column(String(16), primary_key=True)
+    num = Column(BigInteger, nullable=False)
+    head = Column(BigInteger, nullable=True)
+    updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PendingBlock(Base):
+    """
+    Неподтвержденные блоки, обработанные в быстром режиме сканера.
+    По ним проверяется цепочка parent_hash и находятся транзакции для отката при форке,
+    после solidity-высоты строки удаляются
+    """
+    __tablename__ = 'pending_blocks'
+
+    blockchain = Column(String(16), primary_key=True)
+    num = Column(BigInteger, primary_key=True)
+    block_id = Column(String(64), nullable=False)
+    parent_hash = Column(String(64), nullable=True)
+    created = Column(DateTime, default=datetime.utcnow)
+
+
+class BackfillShard(Base):
+    """
+    Чекпоинт исторического сканирования: отрезок [start, end) и следующий необработанный блок
+    """
+    __tablename__ = 'backfill_shards'
+    __table_args__ = (
+        UniqueConstraint('blockchain', 'start', 'end'),
+    )
+
+    id = Column(INTEGER, primary_key=True)
+    blockchain = Column(String(16), nullable=False)
+    start = Column(BigInteger, nullable=False)
+    end = Column(BigInteger, nullable=False)
+    next_num = Column(BigInteger, nullable=False)
+    updated = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def done(self) -> bool:
+        return self.next_num >= self.end
+
+
 class Currency(BaseCurrency):
     """
     Валюты
@@ -143,6 +195,10 @@ class Token(BaseCurrency):
 
 class Wallet(BaseModel):
     __tablename__ = 'wallets'
+    __table_args__ = (
+        # Для догрузки новых кошельков в WalletRegistry
+        Index('ix_wallets_updated', 'updated'),
+    )
 
     id = Column(INTEGER, primary_key=True)
 
@@ -190,6 +246,10 @@ class Wallet(BaseModel):
 
 class WalletBalance(BaseModel):
     __tablename__ = 'wallet_balances'
+    __table_args__ = (
+        # upsert из BalanceSync
+        UniqueConstraint('wallet_id', 'currency_name', name='uq_wallet_balances_wallet_currency'),
+    )
 
     id = Column(INTEGER, primary_key=True)
 
@@ -205,6 +265,14 @@ class WalletBalance(BaseModel):
 
 class Transaction(Base):
     __tablename__ = 'transactions'
+    __table_args__ = (
+        # /txs/{wallet}: WHERE to_address = ... ORDER BY time DESC, id DESC
+        Index('ix_transactions_to_address_time', 'to_address', text('time DESC'), text('id DESC')),
+        # Подтверждение и откат неподтвержденных транзакций по хэшу блока.
+        # FAILED из неподтвержденного блока при форке тоже откатывается
+        Index('ix_transactions_unconfirmed_block_hash', 'block_hash',
+              postgresql_where=text("status IN ('pending', 'failed')")),
+    )
 
     class TransactionType:
         DEPOSIT = 'deposit'
@@ -214,14 +282,17 @@ class Transaction(Base):
     class TransactionStatus:
         SUCCESS = 'success'
         PENDING = 'pending'
+        # Контракт откатился (REVERT, OUT_OF_ENERGY, ...), хотя в блоке транзакция есть
+        FAILED = 'failed'
 
     id = Column(INTEGER, primary_key=True)
 
     contract_address = Column(String(64), ForeignKey(Token.contract_address))
-    currency_name = Column(String(16), ForeignKey(Currency.name), nullable=True)
+    currency_name = Column(String(16), ForeignKey(Currency.name), nullable=True, index=True)
     currency = relationship('Currency', back_populates='transactions')
 
     block_num = Column(String(256), nullable=True)
+    block_hash = Column(String(64), nullable=True)
     txid = Column(String(66), nullable=False, unique=True) # TODO: uniq and PK?
     from_address = Column(String(64), nullable=True, index=True) # TODO: nullable=True ?
     to_address = Column(String(64), nullable=False, index=True)
@@ -263,6 +334,29 @@ class Transaction(Base):
         return db_tx.scalar()
 
 
+class WebhookOutbox(Base):
+    """
+    Вебхуки о новых транзакциях. Пишутся в одной транзакции с Transaction,
+    отправляет utils.webhooks.WebhookDispatcher
+    """
+    __tablename__ = 'webhook_outbox'
+    __table_args__ = (
+        # Очередь на отправку: WHERE delivered_at IS NULL AND next_attempt_at <= now()
+        Index('ix_webhook_outbox_pending', 'next_attempt_at', postgresql_where=text('delivered_at IS NULL')),
+    )
+
+    id = Column(INTEGER, primary_key=True)
+    transaction_id = Column(INTEGER, ForeignKey(Transaction.id), nullable=False)
+    # Получатель отбрасывает повторы по нему (доставка at-least-once)
+    idempotency_key = Column(String(128), nullable=False, unique=True)
+    payload = Column(Text, nullable=False)
+    attempts = Column(INTEGER, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+    last_error = Column(String(256), nullable=True)
+    created = Column(DateTime, default=datetime.utcnow)
+
+
 class Cryptocurrency(BaseCurrency):
     """
     Внутренние валюты блокчейнов:
@@ -1,32 +1,66 @@
 import asyncio
 import logging
-from abc import ABC, abstractmethod
-from decimal import Decimal
+import time
+from abc import ABC
+from collections import Counter
+from datetime import datetime
 from typing import List, Optional
 
-from aiohttp import ContentTypeError
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, func, update
 from sqlalchemy.future import select
-from sqlalchemy.orm import selectinload
-from tronpy.keys import to_base58check_address
 
-from models import Transaction, Wallet, Currency, WalletBalance, Token, Block
+from models import Transaction, Block, BlockCursor, PendingBlock, WebhookOutbox
 
 from settings import Config
+from utils.balances import BalanceSync
+from utils.broker import EVENT_COLUMNS
 from utils.common import format_date
-from utils.common import parse_txs, TransactionSchema
-from utils.tron import TronAPI
-from utils.tron import get_balance, get_trc20_balance
+from utils.common import apply_receipts, parse_blocks, ParsedBlock, TransactionSchema
+from utils.metrics import HEAD_BLOCK, HEAD_LAG, MATCHED_TXS, PROCESSED_BLOCK, REORGS, SOLID_BLOCK, STAGE_SECONDS, \
+    track_pool
+from utils.metrics import start_server as start_metrics_server
+from utils.notify import NewTx, notify_new_txs
+from utils.parse_pool import ParsePool
+from utils.registry import WalletRegistry
+from utils.tron import TronAPI, close_sessions
+from utils.webhooks import WebhookDispatcher, add_to_outbox, transaction_event
 from db import init_db
 from logger import setup_logger
 logger = logging.getLogger(__name__)
 
 
+class _RangeGap(Exception):
+
+    def __init__(self, block_num: int):
+        super().__init__(block_num)
+        self.block_num = block_num
+
+
 class TronScanner(ABC):
 
     TASK = None
-    def __init__(self):
+    # Строк в одном INSERT (у asyncpg лимит 32767 параметров на запрос)
+    INSERT_BATCH_SIZE = 1000
+
+    def __init__(self, parse_workers: int = None, fast: bool = None):
         self.blockchain = 'TRON'
+        self.next_block_num = None
+        self.last_block_num = None
+        # Быстрый режим: блоки выше solidity-высоты берем с полной ноды
+        self.fast = Config.SCANNER_FAST_MODE if fast is None else fast
+        self.solid_block_num = None
+        self.solid_block_id = None
+        # Хэш блока next_block_num - 1, с ним сверяется parent_hash следующего
+        self.last_block_id = None
+        self.registry = WalletRegistry()
+        # Разбор блоков в отдельных процессах, 0 - в event loop
+        parse_workers = Config.SCANNER_PARSE_WORKERS if parse_workers is None else parse_workers
+        self.parse_pool = ParsePool(parse_workers, self.registry) if parse_workers else None
+        # Вызываются после коммита с (id, txid, to_address, from_address) новых, подтвержденных
+        # и откаченных транзакций - статус и сами строки слушатели дочитывают из БД
+        self.listeners = []
 
 
     def run(self):
@@ -34,103 +68,453 @@ class TronScanner(ABC):
 
     async def _start(self):
         setup_logger()
-        async with init_db() as engine:
-            await self._start_listening(engine)
+        try:
+            async with init_db() as engine:
+                track_pool('scanner', engine)
+                services = []
+                if Config.BALANCE_SYNC:
+                    services.append(BalanceSync(engine))
+                if Config.WEBHOOK_URL:
+                    services.append(WebhookDispatcher(engine))
+                for service in services:
+                    service.start()
+                    self.listeners.append(service.touch)
+                try:
+                    await self._start_listening(engine)
+                finally:
+                    for service in services:
+                        self.listeners.remove(service.touch)
+                        await service.stop()
+        finally:
+            if self.parse_pool is not None:
+                self.parse_pool.close()
+            await close_sessions()
 
     async def _start_listening(self, engine):
-        next_block_num = (await self._get_next_block_num(engine))
-        logger.info(next_block_num)
+        self.next_block_num = (await self._get_next_block_num(engine))
+        logger.info(self.next_block_num)
         while True:
             try:
                 async with TronAPI(Config.API_KEY) as tapi:
-                    # Получаем сразу несколько блоков чтоб меньше долбить апи
-                    blocks = (await tapi.get_blocks_by_num_range(next_block_num)) or list()
-                    last_block_num = None
+                    await self._run_pipeline(engine, tapi)
+            except _RangeGap as e:
+                # Нода отдала не весь диапазон - перезапускаемся с первого недостающего блока
+                logger.info(f'Block {e.block_num} is not available yet')
+                await asyncio.sleep(Config.SCANNER_HEAD_SLEEP)
+            except Exception as e:
+                # Если произошла ошибка то начинаем обрабатывать с последнего блока занаво
+                logger.exception(f'\n\nError process block - {self.next_block_num} \n\n {e}')
+                await asyncio.sleep(Config.SCANNER_HEAD_SLEEP)
 
-                    async with AsyncSession(bind=engine) as session:
-                        for block in blocks:
-                            # обходим блок
-                            await self._process_block(session, block)
+    async def _run_pipeline(self, engine, tapi: TronAPI):
+        """
+        Producer качает до SCANNER_PREFETCH_RANGES диапазонов наперед,
+        consumer обрабатывает блоки строго по порядку высоты
+        """
+        # Producer фильтрует блоки по реестру еще при разборе в ParsePool,
+        # поэтому загружаем его до первого запроса - иначе первые диапазоны разберутся с пустым реестром
+        async with AsyncSession(bind=engine) as session:
+            await self.registry.refresh(session)
 
-                            last_block_num = block['block_header']['raw_data']['number']
-                            session.add(Block(num=last_block_num, blockchain=self.blockchain))
-                            await session.commit()
+        if self.fast:
+            async with AsyncSession(bind=engine) as session:
+                self.last_block_id = await self._get_block_id(session, self.next_block_num - 1)
 
-                    if last_block_num is not None:
-                        next_block_num = last_block_num + 1
+        queue = asyncio.Queue(maxsize=Config.SCANNER_PREFETCH_RANGES)
+        producer = asyncio.create_task(self._fetch_ranges(tapi, queue, self.next_block_num))
+        try:
+            while True:
+                start, end, fetch = await self._next_range(queue, producer)
+                blocks = (await fetch) or list()
 
-                await asyncio.sleep(2)
-            except ContentTypeError:
-                pass
-            except Exception as e:
-                # Если произошла ошибка то начинаем обрабатывать с последнего блока занаво
-                logger.exception(f'\n\nError process block - {next_block_num} \n\n {e}')
+                started = time.perf_counter()
+                await self._store_range(engine, tapi, blocks)
+                STAGE_SECONDS.labels('db').observe(time.perf_counter() - started)
+                PROCESSED_BLOCK.set(self.next_block_num - 1)
+                if self.last_block_num is not None:
+                    HEAD_LAG.set(self.last_block_num - self.next_block_num + 1)
+
+                if self.next_block_num < end:
+                    raise _RangeGap(self.next_block_num)
+        finally:
+            producer.cancel()
+            while not queue.empty():
+                _, _, fetch = queue.get_nowait()
+                fetch.cancel()
+
+    @staticmethod
+    async def _next_range(queue: asyncio.Queue, producer: asyncio.Task):
+        getter = asyncio.ensure_future(queue.get())
+        await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+        if not getter.done():
+            getter.cancel()
+            # Producer упал - пробрасываем его ошибку
+            producer.result()
+            raise RuntimeError('Block producer stopped')
+        return getter.result()
+
+    async def _store_range(self, engine, tapi: TronAPI, blocks: List[ParsedBlock]):
+        """
+        Весь диапазон пишем одной транзакцией вместе с курсором, слушатели - после коммита
+        """
+        async with AsyncSession(bind=engine) as session:
+            await self.registry.refresh(session)
+            next_block_num, new_txs = await self._process_blocks(session, blocks, self.next_block_num)
+            if self.fast:
+                next_block_num, new_txs = await self._confirm_blocks(session, tapi, next_block_num, new_txs)
+
+            # После отката форка курсор уходит назад. Подтверждение без новых блоков
+            # курсор не двигает, но его тоже коммитим - иначе события ждали бы следующего блока
+            if next_block_num != self.next_block_num or new_txs:
+                await self._save_cursor(session, next_block_num - 1)
+                await notify_new_txs(session, Config.SCANNER_CHANNEL, new_txs)
+                await session.commit()
+                self.next_block_num = next_block_num
+                self._notify(new_txs)
+
+    async def _fetch_ranges(self, tapi: TronAPI, queue: asyncio.Queue, block_num: int):
+        last_block_num = await self._get_head(tapi)
+        while True:
+            if block_num > last_block_num:
+                # Дошли до головы цепочки - ждем новые блоки
+                await asyncio.sleep(Config.SCANNER_HEAD_SLEEP)
+                last_block_num = await self._get_head(tapi)
+                continue
+
+            num_range = Config.SCANNER_RANGE_SIZE
+            if Config.SCANNER_CATCH_UP and last_block_num - block_num >= Config.SCANNER_CATCH_UP_RANGE_SIZE:
+                num_range = Config.SCANNER_CATCH_UP_RANGE_SIZE
+
+            end = min(block_num + num_range, last_block_num + 1)
+            confirmed = True
+            if self.fast:
+                # Диапазон не пересекает solidity-высоту: ниже нее блоки берем уже подтвержденными
+                if block_num > self.solid_block_num:
+                    confirmed = False
+                else:
+                    end = min(end, self.solid_block_num + 1)
+
+            fetch = asyncio.ensure_future(self._fetch_range(tapi, block_num, end - block_num, confirmed))
+            try:
+                await queue.put((block_num, end, fetch))
+            except asyncio.CancelledError:
+                # Очередь полна и producer отменили: этот fetch в очередь не попал, _run_pipeline его не отменит
+                fetch.cancel()
+                raise
+            block_num = end
+
+    async def _get_head(self, tapi: TronAPI) -> int:
+        if self.fast:
+            head, solid = await asyncio.gather(tapi.get_now_block(confirmed=False), tapi.get_now_block())
+            self.last_block_num = head.num
+            self.solid_block_num, self.solid_block_id = solid.num, solid.block_id
+            SOLID_BLOCK.set(self.solid_block_num)
+        else:
+            self.last_block_num = await tapi.get_last_block_num()
+        HEAD_BLOCK.set(self.last_block_num)
+        return self.last_block_num
+
+    async def _fetch_range(self, tapi: TronAPI, block_num: int, num_range: int,
+                           confirmed: bool = True) -> List[ParsedBlock]:
+        started = time.perf_counter()
+        raw = await tapi.get_blocks_raw(block_num, num_range, confirmed)
+        STAGE_SECONDS.labels('fetch').observe(time.perf_counter() - started)
+
+        timings = {}
+        if self.parse_pool is not None:
+            blocks = await self.parse_pool.parse(raw, timings)
+        else:
+            blocks = parse_blocks(raw, self.registry.wallets, self.registry.contracts, timings)
+        for stage, spent in timings.items():
+            STAGE_SECONDS.labels(stage).observe(spent)
+        if not confirmed:
+            for block in blocks:
+                block.confirmed = False
+        if Config.SCANNER_FETCH_RECEIPTS:
+            await self._fetch_receipts(tapi, blocks, confirmed)
+        return blocks
+
+    async def _fetch_receipts(self, tapi: TronAPI, blocks: List[ParsedBlock], confirmed: bool):
+        """
+        Квитанции только блоков с нашими транзакциями - параллельно друг с другом
+        и с загрузкой следующих диапазонов, до записи в БД
+        """
+        matched = [block for block in blocks if block.txs]
+        if not matched:
+            return
+
+        started = time.perf_counter()
+        infos = await asyncio.gather(*(tapi.get_transaction_infos(block.num, confirmed) for block in matched))
+        STAGE_SECONDS.labels('receipts').observe(time.perf_counter() - started)
+
+        for block, block_infos in zip(matched, infos):
+            apply_receipts(block.txs, block_infos)
 
     async def _get_next_block_num(self, engine):
         """
         Return last_block_num+1 from BD or last_block_num from API
         """
         async with AsyncSession(bind=engine) as session:
-            last_block = (await session.execute(select(Block).order_by(-Block.num))).scalars().first()
-            last_block_num = last_block.num + 1 if last_block else None
+            last_block_num = (await session.execute(
+                select(BlockCursor.num).where(BlockCursor.blockchain == self.blockchain)
+            )).scalar()
 
-        if last_block_num is None:
-            async with TronAPI(Config.API_KEY) as tapi:
-                last_block_num = await tapi.get_last_block_num()
+            if last_block_num is None:
+                # Курсора еще нет - продолжаем со старого журнала блоков
+                last_block_num = (await session.execute(
+                    select(func.max(Block.num)).where(Block.blockchain == self.blockchain)
+                )).scalar()
 
-        return last_block_num
+        if last_block_num is not None:
+            return last_block_num + 1
 
-    async def _process_block(self, session: AsyncSession, next_block: dict):
-        block_num = next_block['block_header']['raw_data']['number']
-        txs = next_block.get('transactions')
+        async with TronAPI(Config.API_KEY) as tapi:
+            return await tapi.get_last_block_num()
 
-        if txs is None and next_block.get('blockID'):
-            logger.info(f'CUR block {block_num}: no txs in block')
-            # Block doesnt have txs
-            return
+    async def _save_cursor(self, session: AsyncSession, block_num: int):
+        stmt = insert(BlockCursor).values(
+            blockchain=self.blockchain, num=block_num, head=self.last_block_num, updated=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[BlockCursor.blockchain],
+            set_={'num': stmt.excluded.num, 'head': stmt.excluded.head, 'updated': stmt.excluded.updated},
+        )
+        await session.execute(stmt)
 
-        logger.info(f'Current block {block_num} {Config.TRON_NODE}')
+    async def _process_blocks(self, session: AsyncSession, blocks: List[ParsedBlock], block_num: int):
+        """
+        Обходит блоки строго подряд начиная с block_num.
+        Возвращает номер следующего необработанного блока и добавленные транзакции
+        """
+        new_txs = []
+        for block in sorted(blocks, key=lambda b: b.num):
+            if block.num < block_num:
+                continue
+            if block.num != block_num:
+                break
 
+            if self.fast and self.last_block_id is not None and block.parent_hash != self.last_block_id:
+                # Блок block_num - 1 ушел в форк: откатываем его и перечитываем с него.
+                # Если форк глубже, на следующем проходе не сойдется уже его parent_hash
+                orphaned = await self._rollback(session, block_num - 1)
+                new_txs = self._without_orphaned(new_txs, orphaned)
+                block_num -= 1
+                self.last_block_id = await self._get_block_id(session, block_num - 1)
+                break
 
-        wallets = set((await session.execute(select(Wallet.address))).scalars().all())
-        contracts = (await session.execute(
-                     select(Token).options(selectinload(Token.currency))
-                      )).scalars().all()
-        contracts = {token.contract_address: {'name': token.name, 'dec': token.decimals} for token in contracts}
+            # обходим блок
+            new_txs.extend(await self._process_block(session, block))
+            if self.fast:
+                if not block.confirmed:
+                    await self._save_pending_block(session, block)
+                self.last_block_id = block.block_id
+            block_num = block.num + 1
 
-        txs = parse_txs(txs, wallets, contracts)
-        for tx in txs:
+        return block_num, new_txs
+
+    async def _get_block_id(self, session: AsyncSession, block_num: int) -> Optional[str]:
+        """
+        Хэш неподтвержденного блока, None если блок уже подтвержден или не обрабатывался
+        """
+        return (await session.execute(select(PendingBlock.block_id).where(
+            PendingBlock.blockchain == self.blockchain, PendingBlock.num == block_num))).scalar()
+
+    async def _save_pending_block(self, session: AsyncSession, block: ParsedBlock):
+        stmt = insert(PendingBlock).values(blockchain=self.blockchain, num=block.num, block_id=block.block_id,
+                                           parent_hash=block.parent_hash, created=datetime.utcnow())
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[PendingBlock.blockchain, PendingBlock.num],
+            set_={'block_id': stmt.excluded.block_id, 'parent_hash': stmt.excluded.parent_hash},
+        )
+        await session.execute(stmt)
+
+    @staticmethod
+    def _without_orphaned(new_txs: list, orphaned: list) -> list:
+        """
+        Откаченные уже могли попасть в кэш /txs/{wallet} - слушатели получают и их,
+        брокер удаленные строки просто не найдет
+        """
+        orphaned_ids = {tx.id for tx in orphaned}
+        return [tx for tx in new_txs if tx.id not in orphaned_ids] + orphaned
+
+    async def _rollback(self, session: AsyncSession, block_num: int) -> list:
+        """
+        Удаляет неподтвержденные блоки начиная с block_num и их PENDING/FAILED транзакции.
+        До подтверждения блока событий о них не было, отзывать нечего.
+        Возвращает (id, txid, to_address, from_address) удаленных транзакций
+        """
+        orphaned_blocks = select(PendingBlock.block_id).where(
+            PendingBlock.blockchain == self.blockchain, PendingBlock.num >= block_num)
+        orphaned = [NewTx(*tx) for tx in (await session.execute(
+            select(Transaction.id, Transaction.txid, Transaction.to_address, Transaction.from_address).where(
+                Transaction.status.in_((Transaction.TransactionStatus.PENDING, Transaction.TransactionStatus.FAILED)),
+                Transaction.block_hash.in_(orphaned_blocks),
+            ))).all()]
+
+        if orphaned:
+            orphaned_ids = [tx.id for tx in orphaned]
+            await session.execute(delete(WebhookOutbox).where(WebhookOutbox.transaction_id.in_(orphaned_ids))
+                                  .execution_options(synchronize_session=False))
+            await session.execute(delete(Transaction).where(Transaction.id.in_(orphaned_ids))
+                                  .execution_options(synchronize_session=False))
+        await session.execute(delete(PendingBlock).where(
+            PendingBlock.blockchain == self.blockchain, PendingBlock.num >= block_num,
+        ).execution_options(synchronize_session=False))
+
+        REORGS.inc()
+        logger.warning('Fork at block %s: rolled back %s pending transactions', block_num, len(orphaned),
+                       extra={'block': block_num, 'sample': False})
+        return orphaned
+
+    async def _confirm_blocks(self, session: AsyncSession, tapi: TronAPI, block_num: int, new_txs: list):
+        """
+        PENDING -> SUCCESS для блоков не выше solidity-высоты.
+        Неподтвержденные блоки связаны проверкой parent_hash, поэтому с solidity-нодой
+        сверяем только хэш верхнего из них. Не сошелся - форк ниже, откатываем все неподтвержденные.
+        Вебхук и событие брокера по транзакции уходят только здесь, после подтверждения
+        """
+        top = (await session.execute(
+            select(PendingBlock.num, PendingBlock.block_id)
+            .where(PendingBlock.blockchain == self.blockchain, PendingBlock.num <= self.solid_block_num)
+            .order_by(PendingBlock.num.desc())
+            .limit(1)
+        )).first()
+        if top is None:
+            return block_num, new_txs
+
+        if top.num == self.solid_block_num:
+            solid_id = self.solid_block_id
+        else:
+            solid = await tapi.get_block_by_num(top.num)
+            if solid is None:
+                return block_num, new_txs
+            solid_id = solid.block_id
+
+        if solid_id != top.block_id:
+            lowest = (await session.execute(select(func.min(PendingBlock.num)).where(
+                PendingBlock.blockchain == self.blockchain))).scalar()
+            orphaned = await self._rollback(session, lowest)
+            self.last_block_id = None
+            return lowest, self._without_orphaned(new_txs, orphaned)
+
+        confirmed_blocks = select(PendingBlock.block_id).where(
+            PendingBlock.blockchain == self.blockchain, PendingBlock.num <= top.num)
+        confirmed = (await session.execute(
+            update(Transaction)
+            .where(Transaction.status == Transaction.TransactionStatus.PENDING,
+                   Transaction.block_hash.in_(confirmed_blocks))
+            .values(status=Transaction.TransactionStatus.SUCCESS)
+            .returning(*EVENT_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )).all()
+
+        if confirmed:
+            if Config.WEBHOOK_URL:
+                await add_to_outbox(session, [transaction_event(tx.id, tx._mapping) for tx in confirmed])
+            # Брокер и кэш узнают о подтверждении тем же уведомлением, что и о новых транзакциях
+            known = {tx.id for tx in new_txs}
+            new_txs = new_txs + [NewTx(tx.id, tx.txid, tx.to_address, tx.from_address)
+                                 for tx in confirmed if tx.id not in known]
+        await session.execute(delete(PendingBlock).where(
+            PendingBlock.blockchain == self.blockchain, PendingBlock.num <= top.num,
+        ).execution_options(synchronize_session=False))
+        return block_num, new_txs
+
+    async def _process_block(self, session: AsyncSession, next_block: ParsedBlock) -> list:
+        block_num = next_block.num
+
+        if not next_block.tx_count:
+            logger.info('CUR block %s: no txs in block', block_num, extra={'block': block_num})
+            # Block doesnt have txs
+            return []
+
+        logger.info('Current block %s %s', block_num, Config.TRON_NODE,
+                    extra={'block': block_num, 'matched': len(next_block.txs)})
+
+        block_time = next_block.timestamp / 1000 if next_block.timestamp is not None else None
+        return await self._process_txs(next_block.txs, block_num, session, block_hash=next_block.block_id,
+                                       confirmed=next_block.confirmed, block_time=block_time)
+
+    def _notify(self, new_txs: list):
+        if not new_txs:
+            return
+        for listener in self.listeners:
             try:
-                await self._process_tx(tx, block_num, session)
+                listener(new_txs)
             except Exception as e:
-                logger.exception(f'Transaction error {tx.tx_id}: {e}')
-    async def _process_tx(self, tx: TransactionSchema, block_num: int, session: AsyncSession):
+                logger.exception(f'Listener {listener} error: {e}')
 
-        if (await session.execute(select(Transaction).where(Transaction.txid == tx.tx_id))).scalar() is not None:
-            logger.info(f'Транзакция {tx.tx_id} уже есть в базе')
-            return
+    async def _process_txs(self, txs: List[TransactionSchema], block_num: int, session: AsyncSession,
+                           block_hash: str = None, confirmed: bool = True, block_time: float = None) -> list:
+        """
+        Все наши транзакции блока одним INSERT ... ON CONFLICT (txid) DO NOTHING.
+        Кошельки уже отфильтрованы в parse_txs, валюту берем из реестра.
+        Без timestamp в raw_data время транзакции - время блока, time нужен курсору /txs/{wallet}.
+        Транзакции неподтвержденного блока пишутся PENDING, откатившиеся по квитанции - FAILED.
+        Возвращает (id, txid, to_address, from_address) реально добавленных транзакций
+        """
+        if not txs:
+            return []
 
+        for currency, count in Counter(tx.currency_name for tx in txs).items():
+            MATCHED_TXS.labels(currency).inc(count)
 
-        if (await session.execute(select(Wallet).where(Wallet.address == tx.to_address))).scalar() is None:
-            logger.info(f'адреса {tx.to_address} нет в базе')
-            return
+        created = datetime.utcnow()
+        status = Transaction.TransactionStatus.SUCCESS if confirmed else Transaction.TransactionStatus.PENDING
+        rows = [
+            dict(
+                contract_address=tx.contract_address,
+                block_num=str(block_num),
+                block_hash=block_hash,
+                txid=tx.tx_id,
+                from_address=tx.from_address,
+                to_address=tx.to_address,
+                amount=tx.amount,
+                currency_name=tx.currency_name if tx.currency_name in self.registry.currencies else None,
+                time=format_date(tx.time if tx.time is not None else block_time),
+                purpose=tx.purpose,
+                status=status if tx.succeeded else Transaction.TransactionStatus.FAILED,
+                trc20=tx.trc20,
+                fee=tx.fee,
+                gas_used=tx.energy_used,
+                created=created,
+            )
+            for tx in txs
+        ]
+
+        inserted = []
+        for i in range(0, len(rows), self.INSERT_BATCH_SIZE):
+            stmt = insert(Transaction).values(rows[i:i + self.INSERT_BATCH_SIZE]).on_conflict_do_nothing(
+                index_elements=[Transaction.txid]
+            ).returning(Transaction.id, Transaction.txid, Transaction.to_address, Transaction.from_address)
+            inserted.extend((await session.execute(stmt)).all())
+
+        if Config.WEBHOOK_URL and inserted:
+            # Событие коммитится вместе с транзакцией, отправит WebhookDispatcher.
+            # PENDING - только после подтверждения блока в _confirm_blocks,
+            # откатившиеся (FAILED) средств не перевели - о них не сообщаем
+            by_txid = {row['txid']: row for row in rows}
+            events = [transaction_event(tx.id, by_txid[tx.txid]) for tx in inserted
+                      if by_txid[tx.txid]['status'] == Transaction.TransactionStatus.SUCCESS]
+            if events:
+                await add_to_outbox(session, events)
+
+        new_txids = {row.txid for row in inserted}
+        for tx in txs:
+            if tx.tx_id in new_txids:
+                # Наши транзакции не сэмплируются
+                logger.info('Новая транзакция (%s): %s -> %s %s %s %s',
+                            tx.purpose, tx.from_address, tx.to_address, tx.amount, tx.currency_name, tx.tx_id,
+                            extra={'block': block_num, 'txid': tx.tx_id, 'sample': False})
+
+        if len(inserted) < len(txs):
+            logger.info('Block %s: %s транзакций уже есть в базе', block_num, len(txs) - len(inserted),
+                        extra={'block': block_num})
+
+        return inserted
 
-        currency = (await session.execute(select(Currency).where(Currency.name == tx.currency_name))).scalar()
-        logger.info(
-            f'Новая входящая транзакция: {tx.from_address} -> {tx.to_address} {tx.amount} {tx.currency_name} {tx.tx_id}')
-
-        new_tx = Transaction(
-            contract_address=tx.contract_address,
-            block_num=str(block_num),
-            txid=tx.tx_id,
-            from_address=tx.from_address,
-            to_address=tx.to_address,
-            amount=tx.amount,
-            currency=currency,
-            time=format_date(tx.time),
-            purpose=Transaction.TransactionType.DEPOSIT,
-            status=Transaction.TransactionStatus.SUCCESS,
-            trc20=tx.trc20
-        )
 
-        session.add(new_tx)
+if __name__ == '__main__':
+    # Отдельный процесс сканера, API запускается с SCANNER_MODE=standalone
+    if Config.METRICS_PORT:
+        start_metrics_server(Config.METRICS_PORT)
+    TronScanner().run()
@@ -8,12 +8,111 @@ class BaseConfig:
     DB_HOST = os.environ.get('POSTGRES_HOST', 'localhost')
     DB_PORT = os.environ.get('POSTGRES_PORT', 5432)
     DB_URL = f'postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
+    DB_DSN = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}'
+    # Пулы соединений API и сканера настраиваются отдельно
+    API_DB_POOL_SIZE = int(os.environ.get('API_DB_POOL_SIZE', 10))
+    API_DB_MAX_OVERFLOW = int(os.environ.get('API_DB_MAX_OVERFLOW', 10))
+    SCANNER_DB_POOL_SIZE = int(os.environ.get('SCANNER_DB_POOL_SIZE', 5))
+    SCANNER_DB_MAX_OVERFLOW = int(os.environ.get('SCANNER_DB_MAX_OVERFLOW', 5))
 
     USDT_CONTRACT = 'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t'
     API_KEY = os.environ.get('API_KEY', '04d8419d-953a-48cd-a2fb-48b2830fbc96')
     NETWORK = 'mainnet'
     TRON_HOST = 'api.trongrid.io'
     TRON_NODE = f'https://{TRON_HOST}/'
+    # Ноды через запятую, TronAPI выбирает самую здоровую и переключается при ошибках
+    TRON_ENDPOINTS = [e.strip() for e in os.environ.get('TRON_ENDPOINTS', TRON_NODE).split(',') if e.strip()]
+    TRON_REQUEST_TIMEOUT = float(os.environ.get('TRON_REQUEST_TIMEOUT', 10))
+    # Бюджет запросов TronGrid API-ключа на весь процесс (0 - без ограничений)
+    TRON_API_QPS = float(os.environ.get('TRON_API_QPS', 15))
+    TRON_API_BURST = float(os.environ.get('TRON_API_BURST', 15))
+    # Пул keep-alive соединений общей HTTP-сессии
+    HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 32))
+    HTTP_POOL_SIZE_PER_HOST = int(os.environ.get('HTTP_POOL_SIZE_PER_HOST', 16))
+    HTTP_KEEPALIVE_TIMEOUT = float(os.environ.get('HTTP_KEEPALIVE_TIMEOUT', 60))
+    HTTP_DNS_CACHE_TTL = int(os.environ.get('HTTP_DNS_CACHE_TTL', 300))
+    # Дублируем медленный getblockbylimitnext на вторую ноду через p95 задержки
+    TRON_HEDGE = os.environ.get('TRON_HEDGE', 'true').lower() in ('1', 'true', 'yes')
+    TRON_HEDGE_DELAY = float(os.environ.get('TRON_HEDGE_DELAY', 1))
+
+    # embedded - сканер крутится в процессе API, standalone - отдельным процессом (python scanner.py)
+    SCANNER_MODE = os.environ.get('SCANNER_MODE', 'embedded')
+    # Канал LISTEN/NOTIFY, через который сканер сообщает API о новых транзакциях
+    SCANNER_CHANNEL = 'tron_scanner'
+    # Сканер считается зависшим, если курсор не двигался дольше (сек)
+    SCANNER_STALE_AFTER = float(os.environ.get('SCANNER_STALE_AFTER', 120))
+
+    # Сколько диапазонов блоков качаем параллельно, пока обрабатываем текущий
+    SCANNER_PREFETCH_RANGES = int(os.environ.get('SCANNER_PREFETCH_RANGES', 4))
+    SCANNER_RANGE_SIZE = int(os.environ.get('SCANNER_RANGE_SIZE', 5))
+    # Догоняем голову цепочки широкими диапазонами без пауз
+    SCANNER_CATCH_UP = os.environ.get('SCANNER_CATCH_UP', 'true').lower() in ('1', 'true', 'yes')
+    SCANNER_CATCH_UP_RANGE_SIZE = int(os.environ.get('SCANNER_CATCH_UP_RANGE_SIZE', 50))
+    # Быстрый режим: неподтвержденные блоки полной ноды (~3 сек вместо ~60 до solidity),
+    # транзакции пишутся PENDING и становятся SUCCESS после solidity-высоты, форки откатываются
+    SCANNER_FAST_MODE = os.environ.get('SCANNER_FAST_MODE', 'false').lower() in ('1', 'true', 'yes')
+    # Квитанции (комиссия, энергия, REVERT) - запрос gettransactioninfobyblocknum на каждый блок с нашими транзакциями
+    SCANNER_FETCH_RECEIPTS = os.environ.get('SCANNER_FETCH_RECEIPTS', 'true').lower() in ('1', 'true', 'yes')
+    SCANNER_HEAD_SLEEP = float(os.environ.get('SCANNER_HEAD_SLEEP', 2))
+    # Процессов для разбора блоков (0 - разбираем в event loop сканера)
+    SCANNER_PARSE_WORKERS = int(os.environ.get('SCANNER_PARSE_WORKERS', 0))
+
+    # Историческое сканирование (backfill.py)
+    BACKFILL_SHARD_SIZE = int(os.environ.get('BACKFILL_SHARD_SIZE', 20000))
+    BACKFILL_RANGE_SIZE = int(os.environ.get('BACKFILL_RANGE_SIZE', 50))
+    # Бюджет запросов к нодам на весь backfill, делится поровну между воркерами.
+    # Живой сканер со своим TRON_API_QPS ходит параллельно - вместе не больше лимита ключа
+    BACKFILL_QPS = float(os.environ.get('BACKFILL_QPS', TRON_API_QPS / 2))
+    # Ошибок подряд без продвижения, после которых шард считается упавшим
+    BACKFILL_MAX_RETRIES = int(os.environ.get('BACKFILL_MAX_RETRIES', 5))
+
+    # Балансы кошельков, на которые пришли депозиты (utils/balances.py)
+    # Multicall (aggregate) в сети TRON - balanceOf пачки кошельков одним вызовом, пусто - по вызову на кошелек
+    TRON_MULTICALL_CONTRACT = os.environ.get('TRON_MULTICALL_CONTRACT', '')
+    # Без multicall на каждый кошелек по запросу на токен - по умолчанию включаем только с ним
+    BALANCE_SYNC = os.environ.get('BALANCE_SYNC', 'true' if TRON_MULTICALL_CONTRACT else 'false').lower() \
+        in ('1', 'true', 'yes')
+    BALANCE_CONCURRENCY = int(os.environ.get('BALANCE_CONCURRENCY', 8))
+    BALANCE_BATCH_SIZE = int(os.environ.get('BALANCE_BATCH_SIZE', 100))
+    BALANCE_DEBOUNCE = float(os.environ.get('BALANCE_DEBOUNCE', 1))
+    # Своя доля TRON_API_QPS: всплеск депозитов не отнимает у сканера весь лимит
+    BALANCE_QPS = float(os.environ.get('BALANCE_QPS', 3))
+
+    # Как часто догружаем новые кошельки и токены в память сканера (сек)
+    REGISTRY_REFRESH_INTERVAL = float(os.environ.get('REGISTRY_REFRESH_INTERVAL', 10))
+
+    # Постраничная выдача /txs (keyset по id)
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+
+    # Кэш /txs/{wallet} в памяти API
+    WALLET_CACHE_SIZE = int(os.environ.get('WALLET_CACHE_SIZE', 10000))
+    WALLET_CACHE_TTL = float(os.environ.get('WALLET_CACHE_TTL', 30))
+
+    # Вебхуки о новых депозитах (utils/webhooks.py), без WEBHOOK_URL outbox не пишется
+    WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+    WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+    WEBHOOK_TIMEOUT = float(os.environ.get('WEBHOOK_TIMEOUT', 10))
+    WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', 200))
+    WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 20))
+    WEBHOOK_POLL_INTERVAL = float(os.environ.get('WEBHOOK_POLL_INTERVAL', 5))
+    WEBHOOK_BACKOFF_BASE = float(os.environ.get('WEBHOOK_BACKOFF_BASE', 2))
+    WEBHOOK_BACKOFF_MAX = float(os.environ.get('WEBHOOK_BACKOFF_MAX', 3600))
+
+    # /ws/deposits и /sse/deposits: буфер подписчика и что делать, если клиент не успевает
+    # (disconnect - закрыть соединение, клиент дочитает с последнего id; drop_oldest - терять старые)
+    BROKER_BUFFER_SIZE = int(os.environ.get('BROKER_BUFFER_SIZE', 1000))
+    BROKER_OVERFLOW_POLICY = os.environ.get('BROKER_OVERFLOW_POLICY', 'disconnect')
+    BROKER_KEEPALIVE = float(os.environ.get('BROKER_KEEPALIVE', 15))
+
+    # Токен для /admin/* (заголовок X-Admin-Token), пустой - ручки выключены
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+    # text или json (по записи на строку, см. logger.yaml)
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+
+    # /metrics отдельного процесса сканера (0 - выключено), API отдает /metrics сам
+    METRICS_PORT = int(os.environ.get('METRICS_PORT', 9100))
 
     HOST = os.environ.get('HOST', '0.0.0.0')
     PORT = os.environ.get('PORT', 8000)
@@ -8,5 +8,10 @@ sleep 2
 python /app/check_conn.py --service-name db --port 5432  --ip db
 
 
-python load_to_db.py
-python main.py
+if [ "$1" = "scanner" ]; then
+  # Отдельный процесс сканера (SCANNER_MODE=standalone у API)
+  python scanner.py
+else
+  python load_to_db.py
+  python main.py
+fi
@@ -0,0 +1,191 @@
+"""
+Обновление wallet_balances по кошелькам, на которые пришли новые транзакции.
+
+BalanceSync подписывается на TronScanner.listeners, кошельки копятся
+и обновляются пачками с ограниченным числом одновременных запросов к ноде
+и своим лимитом BALANCE_QPS внутри общего TRON_API_QPS.
+TRC20 balanceOf группируются по контракту только с TRON_MULTICALL_CONTRACT:
+пачка кошельков - один вызов aggregate(). Без него группировки нет - по
+запросу balanceOf на каждый кошелек и токен, поэтому BALANCE_SYNC по
+умолчанию включен только при заданном multicall.
+TRX - всегда по запросу getaccount на кошелек.
+Балансы пачки пишутся одним upsert.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Tuple
+
+from eth_abi import decode_abi, encode_abi
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import Token, Transaction, Wallet, WalletBalance
+from settings import Config
+from utils.common import address_to_raw, to_decimal
+from utils.rate_limit import TokenBucket
+from utils.tron import TronAPI
+
+logger = logging.getLogger(__name__)
+
+BALANCE_OF_SELECTOR = '70a08231'  # balanceOf(address)
+
+
+def _address_word(address: str) -> bytes:
+    return address_to_raw(address)[1:].rjust(32, b'\0')
+
+
+class BalanceSync:
+    # Пауза перед повтором пачки, на которой упала нода или БД
+    RETRY_DELAY = 10
+
+    def __init__(self, engine, concurrency: int = None, batch_size: int = None, debounce: float = None,
+                 multicall: str = None, qps: float = None):
+        self.engine = engine
+        self.concurrency = Config.BALANCE_CONCURRENCY if concurrency is None else concurrency
+        self.batch_size = Config.BALANCE_BATCH_SIZE if batch_size is None else batch_size
+        self.debounce = Config.BALANCE_DEBOUNCE if debounce is None else debounce
+        self.multicall = Config.TRON_MULTICALL_CONTRACT if multicall is None else multicall
+        # Запросы балансов проходят и общий лимит процесса - этот только не дает им занять его целиком
+        self.rate_limiter = TokenBucket(Config.BALANCE_QPS if qps is None else qps)
+
+        # Ждут обновления / обновляются прямо сейчас
+        self._pending = set()
+        self._inflight = set()
+        self._semaphore = None
+        self._wakeup = None
+        self._task = None
+        self._batches = set()
+
+    def touch(self, new_txs: list):
+        """
+        Слушатель сканера: (id, txid, to_address, from_address) новых транзакций.
+        Чужие адреса отсеются в refresh по таблице wallets
+        """
+        for tx in new_txs:
+            self._pending.add(tx.to_address)
+            if tx.from_address is not None:
+                self._pending.add(tx.from_address)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        if self._pending:
+            self._wakeup.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in [self._task, *self._batches]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*self._batches, return_exceptions=True)
+        if self._task is not None:
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Копим кошельки соседних блоков в одну пачку
+            await asyncio.sleep(self.debounce)
+            self._wakeup.clear()
+
+            # Кошелек, который уже обновляется, ждет конца запроса - тот мог уйти до нового депозита
+            ready = list(self._pending - self._inflight)
+            self._pending.difference_update(ready)
+            self._inflight.update(ready)
+
+            for i in range(0, len(ready), self.batch_size):
+                task = asyncio.create_task(self._refresh_batch(ready[i:i + self.batch_size]))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+
+    async def _refresh_batch(self, addresses: List[str]):
+        try:
+            await self.refresh(addresses)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f'Balance refresh of {len(addresses)} wallets failed: {e}')
+            await asyncio.sleep(self.RETRY_DELAY)
+            self._pending.update(addresses)
+        finally:
+            self._inflight.difference_update(addresses)
+            if self._pending:
+                self._wakeup.set()
+
+    async def refresh(self, addresses: List[str]) -> int:
+        """
+        Балансы TRX и всех токенов для addresses, возвращает число записанных строк
+        """
+        async with AsyncSession(bind=self.engine) as session:
+            wallets = dict((await session.execute(
+                select(Wallet.address, Wallet.id).where(Wallet.address.in_(addresses))
+            )).all())
+            tokens = (await session.execute(
+                select(Token.contract_address, Token.name, Token.decimals).where(Token.name.isnot(None))
+            )).all()
+        if not wallets:
+            return 0
+
+        addresses = list(wallets)
+        async with TronAPI(Config.API_KEY) as tapi:
+            results = await asyncio.gather(
+                self._trx_balances(tapi, addresses),
+                # TRC10 (contract_address - id токена) через balanceOf не спросить
+                *(self._token_balances(tapi, contract, name, int(decimals), addresses)
+                  for contract, name, decimals in tokens if not contract.isdigit()),
+            )
+
+        now = datetime.utcnow()
+        rows = [
+            dict(wallet_id=wallets[address], currency_name=currency_name, amount=amount, created=now, updated=now)
+            for currency_name, balances in results
+            for address, amount in balances.items()
+        ]
+
+        async with AsyncSession(bind=self.engine) as session:
+            stmt = insert(WalletBalance).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[WalletBalance.wallet_id, WalletBalance.currency_name],
+                set_={'amount': stmt.excluded.amount, 'updated': stmt.excluded.updated},
+            )
+            await session.execute(stmt)
+            await session.commit()
+
+        logger.info(f'Balances: {len(wallets)} wallets, {len(rows)} rows')
+        return len(rows)
+
+    async def _limited(self, func, *args):
+        async with self._semaphore:
+            await self.rate_limiter.acquire()
+            return await func(*args)
+
+    async def _trx_balances(self, tapi: TronAPI, addresses: List[str]) -> Tuple[str, Dict[str, Decimal]]:
+        balances = await asyncio.gather(*(self._limited(tapi.get_account_balance, a) for a in addresses))
+        return Transaction.Currency.TRX, {a: to_decimal(b, 6) for a, b in zip(addresses, balances)}
+
+    async def _token_balances(self, tapi: TronAPI, contract: str, currency_name: str, decimals: int,
+                              addresses: List[str]) -> Tuple[str, Dict[str, Decimal]]:
+        if self.multicall:
+            # aggregate((address,bytes)[]) -> (blockNumber, bytes[]), адреса в ABI без префикса 0x41
+            target = address_to_raw(contract)[1:]
+            calls = [(target, bytes.fromhex(BALANCE_OF_SELECTOR) + _address_word(a)) for a in addresses]
+            res = await self._limited(tapi.trigger_constant, self.multicall, 'aggregate((address,bytes)[])',
+                                      encode_abi(['(address,bytes)[]'], [calls]).hex())
+            _, returned = decode_abi(['uint256', 'bytes[]'], res)
+        else:
+            returned = await asyncio.gather(*(
+                self._limited(tapi.trigger_constant, contract, 'balanceOf(address)', _address_word(a).hex())
+                for a in addresses
+            ))
+
+        return currency_name, {
+            a: to_decimal(int.from_bytes(value[:32], 'big'), decimals) for a, value in zip(addresses, returned)
+        }
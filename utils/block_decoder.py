@@ -0,0 +1,291 @@
+"""
+Разбор ответов getblockbylimitnext/getblockbynum прямо из байт ответа.
+
+Достаем только то, что нужно сканеру, подписи, raw_data_hex и прочее
+не материализуются. Если установлен msgspec - разбор идет в типизированные
+структуры на C, иначе orjson или json из stdlib.
+"""
+import json
+from typing import Dict, List, Optional, Union
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+loads = orjson.loads if orjson is not None else json.loads
+
+
+class TronResponseError(ValueError):
+    pass
+
+
+class TxRecord:
+    __slots__ = ('txid', 'ret', 'type', 'owner_address', 'to_address', 'contract_address', 'amount', 'data',
+                 'asset_name', 'timestamp')
+
+    def __init__(self, txid: str, ret: Optional[str], type: Optional[str], owner_address: Optional[str],
+                 to_address: Optional[str], contract_address: Optional[str], amount: Optional[int],
+                 data: Optional[str], timestamp: Optional[int], asset_name: Optional[str] = None):
+        self.txid = txid
+        self.ret = ret
+        self.type = type
+        self.owner_address = owner_address
+        self.to_address = to_address
+        self.contract_address = contract_address
+        self.amount = amount
+        self.data = data
+        # id TRC10 токена (hex) у TransferAssetContract
+        self.asset_name = asset_name
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return f'[TxRecord {self.txid} {self.type} {self.ret}]'
+
+
+class TxInfoRecord:
+    """
+    Квитанция gettransactioninfobyblocknum: комиссия в sun, энергия и результат исполнения
+    """
+    __slots__ = ('txid', 'fee', 'energy_usage_total', 'result', 'receipt_result')
+
+    def __init__(self, txid: str, fee: Optional[int], energy_usage_total: Optional[int], result: Optional[str],
+                 receipt_result: Optional[str]):
+        self.txid = txid
+        self.fee = fee
+        self.energy_usage_total = energy_usage_total
+        # FAILED на верхнем уровне, у вызовов контрактов еще и receipt.result (REVERT, OUT_OF_ENERGY, ...)
+        self.result = result
+        self.receipt_result = receipt_result
+
+    def __repr__(self):
+        return f'[TxInfoRecord {self.txid} {self.result} {self.receipt_result}]'
+
+    @property
+    def succeeded(self) -> bool:
+        return self.result != 'FAILED' and self.receipt_result in (None, 'SUCCESS')
+
+
+class BlockRecord:
+    __slots__ = ('num', 'block_id', 'parent_hash', 'timestamp', 'txs')
+
+    def __init__(self, num: int, block_id: str, parent_hash: Optional[str], timestamp: Optional[int],
+                 txs: List[TxRecord]):
+        self.num = num
+        self.block_id = block_id
+        self.parent_hash = parent_hash
+        self.timestamp = timestamp
+        self.txs = txs
+
+    def __repr__(self):
+        return f'[BlockRecord {self.num} txs:{len(self.txs)}]'
+
+
+def _tx_from_dict(tx: dict) -> TxRecord:
+    raw_data = tx.get('raw_data') or {}
+    contracts = raw_data.get('contract') or [{}]
+    contract = contracts[0]
+    value = (contract.get('parameter') or {}).get('value') or {}
+    ret = tx.get('ret')
+
+    return TxRecord(
+        txid=tx.get('txID'),
+        ret=ret[0].get('contractRet') if ret else None,
+        type=contract.get('type'),
+        owner_address=value.get('owner_address'),
+        to_address=value.get('to_address'),
+        contract_address=value.get('contract_address'),
+        amount=value.get('amount'),
+        data=value.get('data'),
+        asset_name=value.get('asset_name'),
+        timestamp=raw_data.get('timestamp'),
+    )
+
+
+def _block_from_dict(block: dict) -> BlockRecord:
+    header = block['block_header']['raw_data']
+    return BlockRecord(
+        num=header.get('number', 0),
+        block_id=block.get('blockID'),
+        parent_hash=header.get('parentHash'),
+        timestamp=header.get('timestamp'),
+        txs=[_tx_from_dict(tx) for tx in block.get('transactions') or []],
+    )
+
+
+def _tx_info_from_dict(info: dict) -> TxInfoRecord:
+    receipt = info.get('receipt') or {}
+    return TxInfoRecord(
+        txid=info.get('id'),
+        fee=info.get('fee'),
+        energy_usage_total=receipt.get('energy_usage_total'),
+        result=info.get('result'),
+        receipt_result=receipt.get('result'),
+    )
+
+
+if msgspec is not None:
+
+    class _Value(msgspec.Struct, frozen=True):
+        owner_address: Optional[str] = None
+        to_address: Optional[str] = None
+        contract_address: Optional[str] = None
+        amount: Optional[int] = None
+        data: Optional[str] = None
+        asset_name: Optional[str] = None
+
+    class _Parameter(msgspec.Struct, frozen=True):
+        value: _Value = _Value()
+
+    class _Contract(msgspec.Struct, frozen=True):
+        type: Optional[str] = None
+        parameter: _Parameter = _Parameter()
+
+    class _TxRawData(msgspec.Struct, frozen=True):
+        contract: List[_Contract] = []
+        timestamp: Optional[int] = None
+
+    class _Ret(msgspec.Struct, frozen=True):
+        contractRet: Optional[str] = None
+
+    class _Tx(msgspec.Struct, frozen=True):
+        txID: str
+        raw_data: _TxRawData = _TxRawData()
+        ret: List[_Ret] = []
+
+    class _HeaderRawData(msgspec.Struct, frozen=True):
+        number: int = 0
+        parentHash: Optional[str] = None
+        timestamp: Optional[int] = None
+
+    class _Header(msgspec.Struct, frozen=True):
+        raw_data: _HeaderRawData = _HeaderRawData()
+
+    class _Block(msgspec.Struct, frozen=True):
+        blockID: Optional[str] = None
+        block_header: _Header = _Header()
+        transactions: List[_Tx] = []
+
+    class _Blocks(msgspec.Struct, frozen=True):
+        block: List[_Block] = []
+        Error: Optional[str] = None
+
+    class _BlockOrError(_Block, frozen=True):
+        Error: Optional[str] = None
+
+    class _Receipt(msgspec.Struct, frozen=True):
+        energy_usage_total: Optional[int] = None
+        result: Optional[str] = None
+
+    class _TxInfo(msgspec.Struct, frozen=True):
+        id: str
+        fee: Optional[int] = None
+        result: Optional[str] = None
+        receipt: _Receipt = _Receipt()
+
+    class _TxInfoError(msgspec.Struct, frozen=True):
+        Error: Optional[str] = None
+
+    _blocks_decoder = msgspec.json.Decoder(_Blocks)
+    # Квитанции - массив, пустой блок или ошибка - объект
+    _tx_infos_decoder = msgspec.json.Decoder(Union[List[_TxInfo], _TxInfoError])
+    _block_decoder = msgspec.json.Decoder(_BlockOrError)
+
+    def _tx_from_struct(tx: _Tx) -> TxRecord:
+        contract = tx.raw_data.contract[0] if tx.raw_data.contract else _Contract()
+        value = contract.parameter.value
+        return TxRecord(
+            txid=tx.txID,
+            ret=tx.ret[0].contractRet if tx.ret else None,
+            type=contract.type,
+            owner_address=value.owner_address,
+            to_address=value.to_address,
+            contract_address=value.contract_address,
+            amount=value.amount,
+            data=value.data,
+            asset_name=value.asset_name,
+            timestamp=tx.raw_data.timestamp,
+        )
+
+    def _block_from_struct(block: _Block) -> BlockRecord:
+        header = block.block_header.raw_data
+        return BlockRecord(
+            num=header.number,
+            block_id=block.blockID,
+            parent_hash=header.parentHash,
+            timestamp=header.timestamp,
+            txs=[_tx_from_struct(tx) for tx in block.transactions],
+        )
+
+
+def check_response(raw: bytes) -> bytes:
+    """
+    Сырой ответ отдаем дальше не разбирая, но ошибку ноды ловим сразу
+    """
+    if b'"Error"' in raw[:64]:
+        res = loads(raw)
+        if isinstance(res, dict) and 'Error' in res:
+            raise TronResponseError(res['Error'])
+    return raw
+
+
+def decode_blocks(raw: bytes) -> List[BlockRecord]:
+    """
+    Ответ getblockbylimitnext -> блоки, raw может быть и memoryview (shared memory)
+    """
+    if msgspec is not None:
+        res = _blocks_decoder.decode(raw)
+        if res.Error is not None:
+            raise TronResponseError(res.Error)
+        return [_block_from_struct(block) for block in res.block]
+
+    res = loads(raw if orjson is not None else bytes(raw))
+    if 'Error' in res:
+        raise TronResponseError(res['Error'])
+    return [_block_from_dict(block) for block in res.get('block') or []]
+
+
+def decode_block(raw: bytes) -> Optional[BlockRecord]:
+    """
+    Ответ getblockbynum -> блок, None если блока еще нет (нода отдает {})
+    """
+    if msgspec is not None:
+        res = _block_decoder.decode(raw)
+        if res.Error is not None:
+            raise TronResponseError(res.Error)
+        return _block_from_struct(res) if res.blockID else None
+
+    res = loads(raw)
+    if 'Error' in res:
+        raise TronResponseError(res['Error'])
+    return _block_from_dict(res) if res.get('blockID') else None
+
+
+def decode_transaction_infos(raw: bytes) -> Dict[str, TxInfoRecord]:
+    """
+    Ответ gettransactioninfobyblocknum -> квитанции по txid
+    """
+    if msgspec is not None:
+        res = _tx_infos_decoder.decode(raw)
+        if isinstance(res, _TxInfoError):
+            if res.Error is not None:
+                raise TronResponseError(res.Error)
+            return {}
+        return {
+            info.id: TxInfoRecord(txid=info.id, fee=info.fee, energy_usage_total=info.receipt.energy_usage_total,
+                                  result=info.result, receipt_result=info.receipt.result)
+            for info in res
+        }
+
+    res = loads(raw)
+    if isinstance(res, dict):
+        if 'Error' in res:
+            raise TronResponseError(res['Error'])
+        return {}
+    return {info.get('id'): _tx_info_from_dict(info) for info in res}
@@ -0,0 +1,207 @@
+"""
+Раздача новых депозитов подписчикам /ws/deposits и /sse/deposits.
+
+DepositBroker висит на TronScanner.listeners (в embedded-режиме их вызывает
+сканер, в standalone - ScannerChannel по NOTIFY). По id из уведомления
+одним запросом дочитывает транзакции и раскладывает их в очереди
+подписчиков строго по порядку id. У каждого подписчика своя ограниченная
+очередь. Если клиент не успевает, его отключают (disconnect) или выкидывают
+самые старые события (drop_oldest). Переподключившийся клиент передает
+последний полученный id, пропущенное дочитывается из БД.
+Исходящие (withdraw) подписчикам не уходят - только поступления на кошельки.
+Откатившиеся по квитанции (failed) тоже: средства не пришли. Транзакции
+неподтвержденного блока (pending, быстрый режим сканера) уходят, когда сканер
+подтвердит блок и пришлет их id повторно.
+"""
+import asyncio
+import logging
+from typing import AsyncIterator, Iterable, Optional, Set
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import Transaction
+from settings import Config
+
+logger = logging.getLogger(__name__)
+
+EVENT_COLUMNS = (
+    Transaction.id,
+    Transaction.txid,
+    Transaction.block_num,
+    Transaction.contract_address,
+    Transaction.currency_name,
+    Transaction.from_address,
+    Transaction.to_address,
+    Transaction.amount,
+    Transaction.purpose,
+    Transaction.status,
+    Transaction.time,
+)
+
+
+def tx_event(t) -> dict:
+    return {
+        'id': t.id,
+        'txid': t.txid,
+        'block_num': t.block_num,
+        'contract_address': t.contract_address,
+        'currency_name': t.currency_name,
+        'from_address': t.from_address,
+        'to_address': t.to_address,
+        'amount': str(t.amount),
+        'purpose': t.purpose,
+        'status': t.status,
+        'time': t.time.isoformat() if t.time is not None else None,
+    }
+
+
+class SubscriberOverflow(Exception):
+    pass
+
+
+class Subscription:
+    DISCONNECT = 'disconnect'
+    DROP_OLDEST = 'drop_oldest'
+
+    def __init__(self, wallets: Optional[Set[str]] = None, currencies: Optional[Set[str]] = None,
+                 buffer_size: int = None, policy: str = None):
+        self.wallets = wallets or None
+        self.currencies = currencies or None
+        self.policy = policy or Config.BROKER_OVERFLOW_POLICY
+        self.queue = asyncio.Queue(maxsize=buffer_size or Config.BROKER_BUFFER_SIZE)
+        self.dropped = 0
+        self.overflow = False
+
+    def matches(self, event: dict) -> bool:
+        return event['purpose'] != Transaction.TransactionType.WITHDRAW and \
+               event['status'] == Transaction.TransactionStatus.SUCCESS and \
+               (self.wallets is None or event['to_address'] in self.wallets) and \
+               (self.currencies is None or event['currency_name'] in self.currencies)
+
+    def put(self, event: dict):
+        if self.overflow:
+            return
+        if self.queue.full():
+            if self.policy == self.DROP_OLDEST:
+                self.queue.get_nowait()
+                self.dropped += 1
+            else:
+                # Клиент переподключится с последним id и дочитает пропущенное из БД.
+                # Очередь полна, значит get() сейчас не ждет и увидит флаг на следующем вызове
+                self.overflow = True
+                return
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        if self.overflow:
+            raise SubscriberOverflow(f'Subscriber buffer overflow ({self.queue.maxsize} events)')
+        return await self.queue.get()
+
+
+class DepositBroker:
+    # Сколько транзакций за запрос дочитываем при resume
+    REPLAY_PAGE_SIZE = 500
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._subscriptions: Set[Subscription] = set()
+        self._incoming: Optional[asyncio.Queue] = None
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def start(self):
+        self._incoming = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def publish(self, new_txs: list):
+        """
+        Слушатель сканера: (id, txid, to_address, from_address) закоммиченных транзакций
+        """
+        if self._incoming is not None and self._subscriptions:
+            self._incoming.put_nowait([tx.id for tx in new_txs])
+
+    def subscribe(self, wallets: Iterable[str] = None, currencies: Iterable[str] = None,
+                  **kwargs) -> Subscription:
+        sub = Subscription(set(wallets or ()), set(currencies or ()), **kwargs)
+        self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscriptions.discard(sub)
+        if sub.dropped:
+            logger.info(f'Subscriber dropped {sub.dropped} events')
+
+    async def _run(self):
+        # Один обработчик - события уходят подписчикам в порядке коммитов
+        while True:
+            ids = await self._incoming.get()
+            if not self._subscriptions:
+                continue
+            try:
+                async with AsyncSession(bind=self.engine) as session:
+                    rows = (await session.execute(
+                        select(*EVENT_COLUMNS).where(Transaction.id.in_(ids)).order_by(Transaction.id)
+                    )).all()
+            except Exception as e:
+                logger.exception(f'Broker failed to load {len(ids)} transactions: {e}')
+                continue
+
+            for event in map(tx_event, rows):
+                for sub in list(self._subscriptions):
+                    if sub.matches(event):
+                        sub.put(event)
+
+    async def _replay(self, sub: Subscription, after: int) -> AsyncIterator[dict]:
+        while True:
+            stmt = select(*EVENT_COLUMNS).where(
+                Transaction.id > after, Transaction.purpose != Transaction.TransactionType.WITHDRAW,
+                Transaction.status == Transaction.TransactionStatus.SUCCESS)
+            if sub.wallets is not None:
+                stmt = stmt.where(Transaction.to_address.in_(sub.wallets))
+            if sub.currencies is not None:
+                stmt = stmt.where(Transaction.currency_name.in_(sub.currencies))
+
+            async with AsyncSession(bind=self.engine) as session:
+                rows = (await session.execute(stmt.order_by(Transaction.id).limit(self.REPLAY_PAGE_SIZE))).all()
+
+            for row in rows:
+                yield tx_event(row)
+            if len(rows) < self.REPLAY_PAGE_SIZE:
+                return
+            after = rows[-1].id
+
+    async def events(self, sub: Subscription, after: Optional[int] = None,
+                     keepalive: float = None) -> AsyncIterator[Optional[dict]]:
+        """
+        Сначала пропущенное после after из БД, затем живые события.
+        Подписка уже активна, поэтому то, что пришло во время дочитывания,
+        лежит в очереди - повторы отсекаем по id.
+        Раз в keepalive секунд без событий отдает None
+        """
+        last = after
+        if after is not None:
+            async for event in self._replay(sub, after):
+                last = event['id']
+                yield event
+
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if last is not None and event['id'] <= last:
+                continue
+            last = event['id']
+            yield event
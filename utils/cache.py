@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class _Bucket:
+    """
+    Закэшированные страницы одного кошелька.
+    После invalidate бакет отвязан от кэша и запись в него ничего не дает -
+    так ответ, прочитанный из БД до новой транзакции, не попадет в кэш после нее
+    """
+    MAX_PAGES = 16
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.pages = OrderedDict()
+        self.valid = True
+
+    def get(self, key: Hashable):
+        page = self.pages.get(key)
+        if page is None:
+            return None
+        expires, value = page
+        if expires < time.monotonic():
+            self.pages.pop(key, None)
+            return None
+        return value
+
+    def set(self, key: Hashable, value):
+        if not self.valid:
+            return
+        self.pages[key] = (time.monotonic() + self.ttl, value)
+        self.pages.move_to_end(key)
+        while len(self.pages) > self.MAX_PAGES:
+            self.pages.popitem(last=False)
+
+
+class WalletCache:
+    """
+    LRU по кошелькам с TTL на каждую страницу, сбрасывается сканером при новой транзакции
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._buckets = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def bucket(self, wallet: str) -> _Bucket:
+        bucket = self._buckets.get(wallet)
+        if bucket is None:
+            bucket = self._buckets[wallet] = _Bucket(self.ttl)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)[1].valid = False
+        else:
+            self._buckets.move_to_end(wallet)
+        return bucket
+
+    def invalidate(self, wallet: str):
+        bucket: Optional[_Bucket] = self._buckets.pop(wallet, None)
+        if bucket is not None:
+            bucket.valid = False
+
+    def clear(self):
+        for bucket in self._buckets.values():
+            bucket.valid = False
+        self._buckets.clear()
@@ -1,14 +1,15 @@
 import logging
+import time
 from dataclasses import dataclass
 from datetime import timedelta, timezone, datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Dict, List, Optional
 
-from tronpy.keys import to_base58check_address
+from tronpy.keys import to_base58check_address, to_raw_address
 
 from models import Transaction
-from models import Currency, AsyncSession
-from utils.transfer_data_decoder import decode_transfer
+from utils.block_decoder import TxInfoRecord, TxRecord, decode_blocks
+from utils.transfer_data_decoder import split_trc20_transfer
 
 logger = logging.getLogger()
 
@@ -23,106 +24,153 @@ class TransactionSchema:
     time: int
     trc20: bool
     contract_address: str = None
+    purpose: str = Transaction.TransactionType.DEPOSIT
+    # Из квитанции (apply_receipts), без нее - как было в блоке
+    fee: Optional[Decimal] = None
+    energy_used: Optional[int] = None
+    succeeded: bool = True
 
 
-def get_correct_data(data: str):
-    data = data[8:]
-    data = data.replace('41', '00', 1)
-    return bytes.fromhex(data)
-
-
-def is_transfer(data, transactionFuncId='a9059cbb'):
-    func = data[:8]
-    return func == transactionFuncId
-
-
-def _is_success_tx(tx: dict):
-    try:
-        return tx['ret'][0]["contractRet"] == 'SUCCESS'
-    except Exception:
-        logger.error('error is success')
-        return False
-
-
-def _parse_transfer(data) -> (str, int):
-    try:
-        # data = get_correct_data(data)
-        # address, value = trx_abi.decode_abi(['address', 'uint256'], data)
-        # address = to_hex_address(address)
-        return decode_transfer(data)
-    except Exception as e:
-        logger.exception(f"err parse transfer: {e}")
-        return None, None
+@dataclass
+class ParsedBlock:
+    num: int
+    block_id: str
+    parent_hash: Optional[str]
+    timestamp: Optional[int]
+    tx_count: int
+    txs: List[TransactionSchema]
+    # False - блок с полной ноды, еще не прошел solidity
+    confirmed: bool = True
+
+
+def _parse_tx(tx: TxRecord, wallets, contracts) -> Optional[TransactionSchema]:
+    """
+    TRX, TRC10 и TRC20 transfer()/transferFrom() с нашими кошельками с любой стороны.
+    Отправителя и получателя сверяем с wallets в сыром виде (21 байт) по одному разу,
+    направление определяет purpose, в base58 переводим только совпавшие транзакции
+    """
+    if tx.type == "TransferContract":
+        # TRX transfer
+        from_address = bytes.fromhex(tx.owner_address)
+        to_address = bytes.fromhex(tx.to_address)
+        amount = tx.amount or 0
+        token = None
+
+    elif tx.type == "TriggerSmartContract":
+        # USDT transfer() / transferFrom()
+        token = contracts.get(bytes.fromhex(tx.contract_address))
+        if token is None:
+            return None
+
+        try:
+            transfer = split_trc20_transfer(tx.data or '')
+        except ValueError:
+            logger.error(f"tx with invalid data - {tx.txid}")
+            return None
+
+        if transfer is None:
+            return None
+
+        from_address, to_address, amount = transfer
+        if from_address is None:
+            # transfer() - токены списываются с вызывающего
+            from_address = bytes.fromhex(tx.owner_address)
+
+    elif tx.type == "TransferAssetContract":
+        # TRC10, в contracts лежит по id токена
+        token = contracts.get(bytes.fromhex(tx.asset_name or ''))
+        if token is None:
+            return None
+
+        from_address = bytes.fromhex(tx.owner_address)
+        to_address = bytes.fromhex(tx.to_address)
+        amount = tx.amount or 0
 
+    else:
+        return None
 
-def _parse_tx(tx, contracts):
-    # Только входящие TRX или USDT - transfer()
-    contr = tx["raw_data"]['contract'][0]
+    if to_address in wallets:
+        purpose = Transaction.TransactionType.TRANSFER if from_address in wallets \
+            else Transaction.TransactionType.DEPOSIT
+    elif from_address in wallets:
+        purpose = Transaction.TransactionType.WITHDRAW
+    else:
+        return None
 
-    if contr['type'] == "TransferContract":
-        # TRX transfer
-        to_address = contr['parameter']['value']['to_address']
-        from_address = contr['parameter']['value']['owner_address']
-        amount = to_decimal(contr['parameter']['value']['amount'], 6)
-        if amount < Decimal(0.1):
-            return None, None
+    if token is None:
+        amount = to_decimal(amount, 6)
+        # Пыль на наши кошельки не пишем
+        if purpose == Transaction.TransactionType.DEPOSIT and amount < Decimal(0.1):
+            return None
         currency_name = Transaction.Currency.TRX
         contract_address = None
-        trc20 = False
-
-    elif contr['type'] == "TriggerSmartContract":
-
-        contract_address = tx['raw_data']["contract"][0]["parameter"]["value"]['contract_address']
-        contract_address = to_base58check_address(contract_address)
-
-        if contract_address not in contracts.keys():
-            return None, None
-
-        contr_data = tx['raw_data']["contract"][0]["parameter"]["value"]["data"]
-
-        if not is_transfer(contr_data):
-            return None, None
-
-        to_address, value = _parse_transfer(contr_data)
-        if to_address is None or value is None:
-            logger.error(f"tx with invalid data - {tx['txID']}")
-            return None, None
-
-        amount = to_decimal(value, int(contracts[contract_address]['dec']))
-        from_address = tx['raw_data']["contract"][0]["parameter"]["value"]['owner_address']
-        to_address = to_address
-        currency_name = contracts[contract_address]['name']
-        trc20 = True
-
     else:
-        return None, None
-
-    timestamp = tx['raw_data'].get("timestamp")
-    to_address = to_base58check_address(to_address)
-    from_address = to_base58check_address(from_address)
+        if isinstance(amount, str):
+            # TRC20 - hex из calldata
+            amount = int(amount, 16)
+        amount = to_decimal(amount, int(token['dec']))
+        currency_name = token['name']
+        contract_address = token['address']
+
+    return TransactionSchema(tx_id=tx.txid, time=tx.timestamp / 1000 if (tx.timestamp is not None) else None,
+                             to_address=to_base58check_address(to_address),
+                             from_address=to_base58check_address(from_address),
+                             amount=amount, currency_name=currency_name,
+                             trc20=tx.type == "TriggerSmartContract",
+                             contract_address=contract_address, purpose=purpose)
+
+
+def parse_txs(txs: List[TxRecord], wallets, contracts) -> List[TransactionSchema]:
+    """
+    wallets - сырые адреса (21 байт) отслеживаемых кошельков,
+    contracts - токены по сырому адресу контракта (TRC10 - по id токена)
+    """
+    ret = []
 
-    tx_schema = TransactionSchema(tx_id=tx['txID'], time=timestamp / 1000 if (timestamp is not None) else None,
-                                  to_address=to_address, from_address=from_address,
-                                  amount=amount, currency_name=currency_name, trc20=trc20,
-                                  contract_address=contract_address)
+    for tx in txs:
+        if tx.ret != 'SUCCESS':
+            continue
 
-    return to_address, tx_schema
+        data = _parse_tx(tx, wallets, contracts)
+        if data is not None:
+            ret.append(data)
 
+    return ret
 
-def parse_txs(txs: list, wallets, contracts):
-    ret = []
-    txs = [tx for tx in txs if _is_success_tx(tx)]
 
+def apply_receipts(txs: List[TransactionSchema], infos: Dict[str, TxInfoRecord]):
+    """
+    Комиссия (TRX), энергия и реальный результат исполнения из квитанций блока
+    """
     for tx in txs:
-
-        to_addr, data = _parse_tx(tx, contracts)
-        to_addr = to_base58check_address(to_addr) if to_addr else None
-        if not to_addr or not data or to_addr not in wallets:
+        info = infos.get(tx.tx_id)
+        if info is None:
             continue
+        tx.fee = to_decimal(info.fee or 0, 6)
+        tx.energy_used = info.energy_usage_total
+        tx.succeeded = info.succeeded
 
-        ret.append(data)
 
-    return ret
+def parse_blocks(raw, wallets, contracts, timings: dict = None) -> List[ParsedBlock]:
+    """
+    Сырой ответ getblockbylimitnext -> блоки только с нашими транзакциями.
+    В timings, если передан, пишется время разбора JSON и фильтрации
+    """
+    started = time.perf_counter()
+    blocks = decode_blocks(raw)
+    decoded = time.perf_counter()
+
+    parsed = [
+        ParsedBlock(num=block.num, block_id=block.block_id, parent_hash=block.parent_hash,
+                    timestamp=block.timestamp, tx_count=len(block.txs),
+                    txs=parse_txs(block.txs, wallets, contracts))
+        for block in blocks
+    ]
+
+    if timings is not None:
+        timings['decode'] = decoded - started
+        timings['filter'] = time.perf_counter() - decoded
+    return parsed
 
 
 def format_date(timestamp):
@@ -134,6 +182,17 @@ def format_date(timestamp):
 
 
 
+def address_to_raw(address: str) -> Optional[bytes]:
+    """
+    base58 (или hex) адрес -> 21 байт с префиксом 0x41, None если адрес невалидный
+    """
+    try:
+        raw = to_raw_address(address)
+    except Exception:
+        return None
+    return raw if len(raw) == 21 else None
+
+
 def to_decimal(value, decimals: int) -> Decimal:
     d = Decimal(value).scaleb(-decimals)
     return Decimal(round(d, decimals))
@@ -1,7 +1,12 @@
+import atexit
+import copy
+import json
 import logging
 from contextlib import contextmanager
+from datetime import datetime, timezone
 from logging.handlers import QueueListener, QueueHandler, RotatingFileHandler
 from queue import Queue
+from typing import List
 
 
 @contextmanager
@@ -32,3 +37,123 @@ def prepare_background_logging(log_path):
         raise e
     finally:
         listener.stop()
+
+
+# Атрибуты LogRecord, все остальное в record пришло через extra=
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-строка на запись, поля из extra= кладутся рядом с message
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                data[key] = value
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data['exc_info'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Не больше rate записей в секунду (с запасом burst) с одной строки кода.
+    WARNING и выше, а также записи с extra={'sample': False} проходят всегда. Сколько записей отброшено, дописывается
+    в поле suppressed следующей пропущенной записи с той же строки
+    """
+
+    def __init__(self, rate: float = 5, burst: float = 20, level: int = logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = level
+        # (pathname, lineno) -> [токены, время, отброшено]
+        self._buckets = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.level or not getattr(record, 'sample', True):
+            return True
+        # Одна и та же запись проходит через несколько обработчиков - решаем один раз
+        sampled = getattr(record, '_sampled', None)
+        if sampled is None:
+            sampled = record._sampled = self._sample(record)
+        return sampled
+
+    def _sample(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, record.created, 0]
+
+        tokens = min(self.burst, bucket[0] + (record.created - bucket[1]) * self.rate)
+        bucket[1] = record.created
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+
+        bucket[0] = tokens - 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    """
+    В отличие от QueueHandler не склеивает запись в строку:
+    аргументы подставляются, traceback форматируется в exc_text,
+    extra-поля доезжают до JsonFormatter
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _exc_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_exc_formatter = logging.Formatter()
+_listeners: List[QueueListener] = []
+
+
+def stop_background_logging():
+    while _listeners:
+        _listeners.pop().stop()
+
+
+def start_background_logging(*names: str):
+    """
+    Переносит обработчики логгеров (уже настроенных через dictConfig) в фоновый
+    поток: в event loop остается только запись в очередь
+    """
+    stop_background_logging()
+    for name in names:
+        logger = logging.getLogger(name or None)
+        handlers = [h for h in logger.handlers if not isinstance(h, QueueHandler)]
+        if not handlers:
+            continue
+
+        log_queue = Queue(-1)
+        logger.handlers = [_QueueHandler(log_queue)]
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _listeners.append(listener)
+
+
+# Дописываем очереди при выходе из процесса
+atexit.register(stop_background_logging)
@@ -0,0 +1,87 @@
+"""
+Метрики Prometheus сканера и API.
+
+Если prometheus_client не установлен - все метрики заглушки, код сканера
+от этого не меняется. На горячем пути метрики обновляются раз на диапазон
+блоков или запрос к ноде, не на каждую транзакцию.
+"""
+import logging
+from typing import Tuple
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+logger = logging.getLogger(__name__)
+
+
+class _NoopMetric:
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def set_function(self, f):
+        pass
+
+
+if prometheus_client is not None:
+    from prometheus_client import Counter, Gauge, Histogram
+
+    # От долей миллисекунды (фильтр) до десятков секунд (медленная нода)
+    _BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+    HEAD_BLOCK = Gauge('tron_scanner_head_block', 'Last block reported by the node')
+    PROCESSED_BLOCK = Gauge('tron_scanner_processed_block', 'Last block committed by the scanner')
+    SOLID_BLOCK = Gauge('tron_scanner_solid_block', 'Last solidified block (fast mode)')
+    REORGS = Counter('tron_scanner_reorgs_total', 'Rollbacks of unconfirmed blocks after a fork')
+    HEAD_LAG = Gauge('tron_scanner_lag_blocks', 'Head block minus processed block')
+    STAGE_SECONDS = Histogram('tron_scanner_stage_seconds', 'Time per block range and scanner stage',
+                              ['stage'], buckets=_BUCKETS)
+    NODE_REQUEST_SECONDS = Histogram('tron_node_request_seconds', 'TRON node request latency',
+                                     ['endpoint', 'path'], buckets=_BUCKETS)
+    NODE_REQUEST_ERRORS = Counter('tron_node_request_errors_total', 'Failed TRON node requests',
+                                  ['endpoint', 'path'])
+    MATCHED_TXS = Counter('tron_scanner_matched_txs_total', 'Transactions of watched wallets', ['currency'])
+    DB_POOL = Gauge('tron_db_pool_connections', 'SQLAlchemy pool connections', ['pool', 'state'])
+else:
+    HEAD_BLOCK = PROCESSED_BLOCK = SOLID_BLOCK = REORGS = HEAD_LAG = STAGE_SECONDS = NODE_REQUEST_SECONDS = \
+        NODE_REQUEST_ERRORS = MATCHED_TXS = DB_POOL = _NoopMetric()
+
+
+def track_pool(name: str, engine):
+    """
+    Заполненность пула соединений считается в момент выдачи /metrics
+    """
+    pool = engine.sync_engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return
+    DB_POOL.labels(name, 'size').set_function(pool.size)
+    DB_POOL.labels(name, 'checked_out').set_function(pool.checkedout)
+    DB_POOL.labels(name, 'overflow').set_function(lambda: max(pool.overflow(), 0))
+
+
+def render() -> Tuple[bytes, str]:
+    if prometheus_client is None:
+        return b'# prometheus_client is not installed\n', 'text/plain; charset=utf-8'
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
+
+
+def start_server(port: int):
+    """
+    Отдельный HTTP-сервер /metrics для сканера без API (SCANNER_MODE=standalone)
+    """
+    if prometheus_client is None:
+        logger.warning('prometheus_client is not installed, metrics are disabled')
+        return
+    prometheus_client.start_http_server(port)
+    logger.info(f'Metrics on :{port}/metrics')
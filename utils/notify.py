@@ -0,0 +1,76 @@
+import asyncio
+import json
+import logging
+from collections import namedtuple
+from typing import Callable, List
+
+import asyncpg
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+logger = logging.getLogger(__name__)
+
+# from_address может не быть в сообщениях сканера старой версии
+NewTx = namedtuple('NewTx', ('id', 'txid', 'to_address', 'from_address'), defaults=(None,))
+
+# NOTIFY ограничен 8000 байт на сообщение
+NOTIFY_CHUNK_SIZE = 40
+
+
+async def notify_new_txs(session: AsyncSession, channel: str, new_txs: list):
+    """
+    NOTIFY в транзакции сканера - слушатели получат его только после коммита
+    """
+    for i in range(0, len(new_txs), NOTIFY_CHUNK_SIZE):
+        payload = json.dumps([[tx.id, tx.txid, tx.to_address, tx.from_address] for tx in new_txs[i:i + NOTIFY_CHUNK_SIZE]])
+        await session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': channel, 'payload': payload})
+
+
+class ScannerChannel:
+    """
+    LISTEN на новые транзакции от сканера, запущенного отдельным процессом.
+    Слушатели получают те же (id, txid, to_address, from_address), что и TronScanner.listeners
+    """
+    RECONNECT_DELAY = 5
+
+    def __init__(self, dsn: str, channel: str, listeners: List[Callable]):
+        self.dsn = dsn
+        self.channel = channel
+        self.listeners = listeners
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self):
+        while True:
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                try:
+                    await conn.add_listener(self.channel, self._on_notify)
+                    logger.info(f'Listening {self.channel}')
+                    while not conn.is_closed():
+                        await asyncio.sleep(self.RECONNECT_DELAY)
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f'Channel {self.channel} error: {e}')
+            await asyncio.sleep(self.RECONNECT_DELAY)
+
+    def _on_notify(self, conn, pid, channel, payload):
+        new_txs = [NewTx(*row) for row in json.loads(payload)]
+        for listener in self.listeners:
+            try:
+                listener(new_txs)
+            except Exception as e:
+                logger.exception(f'Listener {listener} error: {e}')
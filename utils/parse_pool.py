@@ -0,0 +1,89 @@
+"""
+Разбор блоков в пуле процессов.
+
+Сырые байты ответа getblockbylimitnext кладутся в shared memory, воркер
+разбирает их прямо из memoryview, обратно через pickle едут только
+ParsedBlock с нашими транзакциями. Порядок блоков и запись в БД остаются
+в основном event loop.
+"""
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Tuple
+
+from utils.common import ParsedBlock, parse_blocks
+from utils.registry import WalletRegistry
+
+logger = logging.getLogger(__name__)
+
+# Состояние воркера: снимок кошельков на момент старта пула + досланные изменения
+_wallets = set()
+_contracts = {}
+
+
+def _init_worker(wallets: set):
+    global _wallets
+    _wallets = wallets
+
+
+def _parse_shared(name: str, size: int, added: list, contracts: dict) -> Tuple[List[ParsedBlock], dict]:
+    global _contracts
+    _wallets.update(added)
+    _contracts = contracts
+
+    # Сегментом владеет основной процесс, воркер только читает и закрывает
+    shm = SharedMemory(name=name)
+    try:
+        view = shm.buf[:size]
+        try:
+            # Метрики воркера до основного процесса не доходят - время стадий возвращаем вместе с блоками
+            timings = {}
+            return parse_blocks(view, _wallets, _contracts, timings), timings
+        finally:
+            view.release()
+    finally:
+        shm.close()
+
+
+class ParsePool:
+    # После стольких новых кошельков пул перезапускается со свежим снимком
+    MAX_ADDED = 50000
+
+    def __init__(self, workers: int, registry: WalletRegistry):
+        self.workers = workers
+        self.registry = registry
+        self.registry.track_added = True
+        self._executor = None
+
+    def _start(self):
+        if self._executor is not None:
+            # Уже отправленные задачи доработают в старом пуле
+            self._executor.shutdown(wait=False)
+
+        self.registry.added.clear()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(set(self.registry.wallets),))
+        logger.info(f'Parse pool: {self.workers} workers, {len(self.registry.wallets)} wallets')
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def parse(self, raw: bytes, timings: dict = None) -> List[ParsedBlock]:
+        if self._executor is None or len(self.registry.added) > self.MAX_ADDED:
+            self._start()
+
+        shm = SharedMemory(create=True, size=max(len(raw), 1))
+        try:
+            shm.buf[:len(raw)] = raw
+            blocks, worker_timings = await asyncio.get_running_loop().run_in_executor(
+                self._executor, _parse_shared, shm.name, len(raw), list(self.registry.added), self.registry.contracts)
+        finally:
+            shm.close()
+            shm.unlink()
+
+        if timings is not None:
+            timings.update(worker_timings)
+        return blocks
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket на весь процесс: rate запросов в секунду, пачкой не больше burst.
+    rate <= 0 - без ограничений
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = None
+        self._loop = None
+
+    def configure(self, rate: float, burst: float = None):
+        """
+        Смена лимита на ходу - например, воркерам backfill достается доля общего бюджета
+        """
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = min(self.tokens, self.capacity)
+
+    def _get_lock(self) -> asyncio.Lock:
+        # Lock привязан к event loop, а asyncio.run может вызываться в процессе несколько раз
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1):
+        if self.rate <= 0:
+            return
+
+        async with self._get_lock():
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
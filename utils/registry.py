@@ -0,0 +1,78 @@
+import logging
+import time
+from datetime import timedelta
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import Wallet, Token, Currency
+from settings import Config
+from utils.common import address_to_raw
+
+logger = logging.getLogger(__name__)
+
+
+class WalletRegistry:
+    """
+    Отслеживаемые кошельки, токены и валюты в памяти сканера.
+    Загружаются один раз при старте, дальше догружаются только
+    кошельки с Wallet.updated новее последней загрузки.
+
+    Ключи - сырые 21-байтовые адреса, чтобы сверять адреса прямо
+    из hex в JSON блока без base58.
+    """
+
+    # Запас на транзакции, которые закоммитились позже, чем проставили updated
+    OVERLAP = timedelta(minutes=1)
+
+    def __init__(self, refresh_interval: float = None):
+        self.refresh_interval = Config.REGISTRY_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        self.wallets = set()
+        self.contracts = {}
+        self.currencies = set()
+        # Кошельки, добавленные после старта - ParsePool досылает их воркерам
+        self.added = []
+        self.track_added = False
+        self._last_updated = None
+        self._refreshed_at = None
+
+    def __contains__(self, address: str) -> bool:
+        return address_to_raw(address) in self.wallets
+
+    def __len__(self) -> int:
+        return len(self.wallets)
+
+    async def refresh(self, session: AsyncSession, force: bool = False):
+        now = time.monotonic()
+        if not force and self._refreshed_at is not None and now - self._refreshed_at < self.refresh_interval:
+            return
+
+        stmt = select(Wallet.address, Wallet.updated)
+        if self._last_updated is not None:
+            stmt = stmt.where(Wallet.updated >= self._last_updated - self.OVERLAP)
+
+        loaded = 0
+        for address, updated in await session.execute(stmt):
+            raw = address_to_raw(address)
+            if raw is None:
+                logger.warning(f'Invalid wallet address {address}')
+            elif raw not in self.wallets:
+                self.wallets.add(raw)
+                if self.track_added:
+                    self.added.append(raw)
+            if updated is not None and (self._last_updated is None or updated > self._last_updated):
+                self._last_updated = updated
+            loaded += 1
+
+        tokens = await session.execute(select(Token.contract_address, Token.name, Token.decimals))
+        self.contracts = {}
+        for address, name, decimals in tokens:
+            # TRC10 - по id токена (asset_name в TransferAssetContract), TRC20 - по сырому адресу контракта
+            key = address.encode() if address.isdigit() else address_to_raw(address)
+            if key is not None:
+                self.contracts[key] = {'name': name, 'dec': decimals, 'address': address}
+        self.currencies = set((await session.execute(select(Currency.name))).scalars().all())
+
+        if self._refreshed_at is None or loaded:
+            logger.info(f'Wallet registry: {len(self.wallets)} wallets, {len(self.contracts)} tokens')
+        self._refreshed_at = now
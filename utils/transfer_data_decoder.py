@@ -1,8 +1,13 @@
-import base58
+from typing import Optional, Tuple
+
 import eth_abi
 
 
-def decode_transfer(tx_data: str) -> (str, int):
+TRANSFER_SELECTOR = 'a9059cbb'  # transfer(address,uint256)
+TRANSFER_FROM_SELECTOR = '23b872dd'  # transferFrom(address,address,uint256)
+
+
+def decode_transfer(tx_data: str) -> (bytes, int):
     # sig = tx_data[:8]
     data = tx_data[8:]
 
@@ -14,6 +19,45 @@ def decode_transfer(tx_data: str) -> (str, int):
 
     decoded_address, decoded_amount = eth_abi.decode_abi(['address', 'uint256'], address_bytes + uint256_bytes)
 
-    tron_address = base58.b58encode_check(bytes.fromhex('41' + decoded_address[2:]))
+    # Сырой адрес (21 байт), в base58 переводим только если кошелек наш
+    raw_address = bytes.fromhex('41' + decoded_address[2:])
+
+    return raw_address, decoded_amount
+
+
+def _decode_address(word: str) -> bytes:
+    # Как и контракт, берем младшие 20 байт: мусор в старших 12 (например 0x41) перевод не ломает
+    return bytes.fromhex('41' + word[24:])
+
+
+def split_trc20_transfer(tx_data: str) -> Optional[Tuple[Optional[bytes], bytes, str]]:
+    """
+    То же, что decode_trc20_transfer, но сумма остается hex-строкой:
+    сканер переводит ее в int только если кошелек наш
+    """
+    selector = tx_data[:8]
+
+    if selector == TRANSFER_SELECTOR:
+        if len(tx_data) < 136:
+            raise ValueError(f'transfer calldata too short: {len(tx_data)}')
+        return None, _decode_address(tx_data[8:72]), tx_data[72:136]
+
+    if selector == TRANSFER_FROM_SELECTOR:
+        if len(tx_data) < 200:
+            raise ValueError(f'transferFrom calldata too short: {len(tx_data)}')
+        return _decode_address(tx_data[8:72]), _decode_address(tx_data[72:136]), tx_data[136:200]
+
+    return None
+
 
-    return tron_address, decoded_amount
+def decode_trc20_transfer(tx_data: str) -> Optional[Tuple[Optional[bytes], bytes, int]]:
+    """
+    Быстрый разбор transfer/transferFrom по фиксированным смещениям без eth_abi.
+    Возвращает (from, to, amount) с сырыми адресами (21 байт), from есть только у transferFrom.
+    None - это не transfer/transferFrom, ValueError - битая calldata
+    """
+    transfer = split_trc20_transfer(tx_data)
+    if transfer is None:
+        return None
+    from_address, to_address, amount = transfer
+    return from_address, to_address, int(amount, 16)
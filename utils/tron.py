@@ -1,58 +1,329 @@
 import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
 from settings import Config
 from tronpy import AsyncTron
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
 from tronpy.providers.async_http import AsyncHTTPProvider
-from tronpy.keys import PrivateKey
+from tronpy.keys import PrivateKey, to_base58check_address
+
+from utils.block_decoder import BlockRecord, TxInfoRecord, check_response, decode_block, decode_blocks, \
+    decode_transaction_infos, loads
+from utils.metrics import NODE_REQUEST_ERRORS, NODE_REQUEST_SECONDS
+from utils.rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Общий на процесс лимит запросов к нодам: сканер, балансы, отправка
+rate_limiter = TokenBucket(Config.TRON_API_QPS, Config.TRON_API_BURST)
+
+_session: Optional[ClientSession] = None
+_httpx_client: Optional[httpx.AsyncClient] = None
+_loop = None
+
+
+def _check_loop():
+    # Сессии привязаны к event loop - в новом loop создаем их заново
+    global _session, _httpx_client, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is not loop:
+        _session = None
+        _httpx_client = None
+        _loop = loop
+
+
+def get_session() -> ClientSession:
+    """
+    Одна aiohttp-сессия на процесс с keep-alive пулом и кэшем DNS
+    """
+    global _session
+    _check_loop()
+    if _session is None or _session.closed:
+        connector = TCPConnector(
+            limit=Config.HTTP_POOL_SIZE,
+            limit_per_host=Config.HTTP_POOL_SIZE_PER_HOST,
+            keepalive_timeout=Config.HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=Config.HTTP_DNS_CACHE_TTL,
+        )
+        _session = ClientSession(connector=connector, timeout=ClientTimeout(total=Config.TRON_REQUEST_TIMEOUT))
+    return _session
+
+
+def get_httpx_client() -> httpx.AsyncClient:
+    """
+    Тот же пул для tronpy, он ходит через httpx
+    """
+    global _httpx_client
+    _check_loop()
+    if _httpx_client is None or _httpx_client.is_closed:
+        headers = {'User-Agent': 'Tronpy/0.2'}
+        if Config.API_KEY and is_trongrid(Config.TRON_NODE):
+            headers['TRON-PRO-API-KEY'] = Config.API_KEY
+        _httpx_client = httpx.AsyncClient(
+            headers=headers,
+            timeout=httpx.Timeout(Config.TRON_REQUEST_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=Config.HTTP_POOL_SIZE,
+                max_keepalive_connections=Config.HTTP_POOL_SIZE_PER_HOST,
+            ),
+        )
+    return _httpx_client
+
+
+async def close_sessions():
+    global _session, _httpx_client
+    if _session is not None and not _session.closed:
+        await _session.close()
+    if _httpx_client is not None and not _httpx_client.is_closed:
+        await _httpx_client.aclose()
+    _session = None
+    _httpx_client = None
+
+
+class TronAPIError(Exception):
+    pass
+
+
+def is_trongrid(url: str) -> bool:
+    """
+    API-ключ TronGrid отправляем только самой TronGrid, не сторонним нодам
+    """
+    host = urlparse(url).hostname or ''
+    return host == 'trongrid.io' or host.endswith('.trongrid.io')
+
+
+class Endpoint:
+    """
+    Нода TRON и ее здоровье: задержки последних запросов и доля ошибок
+    """
+    WINDOW = 100
+    # Сколько секунд задержки "стоит" 100% ошибок при выборе ноды
+    ERROR_PENALTY = 10
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.trongrid = is_trongrid(self.url)
+        self.latencies = deque(maxlen=self.WINDOW)
+        self.error_rate = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def __repr__(self):
+        return f'[Endpoint {self.url} latency:{self.latency:.3f} errors:{self.error_rate:.2f}]'
+
+    @property
+    def latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    @property
+    def score(self) -> float:
+        return self.latency + self.error_rate * self.ERROR_PENALTY
+
+    @property
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < 10:
+            return Config.TRON_HEDGE_DELAY
+        latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * 0.95) - 1]
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.latencies.append(latency)
+        self.error_rate *= 0.9
+
+    def record_lost_hedge(self, elapsed: float):
+        """
+        Основная нода проиграла hedge: ответа не было минимум elapsed секунд.
+        Настоящей задержки нет, пишем оценку снизу - не меньше текущего hedge_delay (p95),
+        иначе медленная нода выглядит быстрой. В requests не считаем - ответа не было
+        """
+        self.latencies.append(max(elapsed, self.hedge_delay))
+
+    def record_error(self):
+        self.requests += 1
+        self.errors += 1
+        self.error_rate = self.error_rate * 0.9 + 0.1
+
+
+# Статистика живет дольше одного TronAPI
+_endpoints: Dict[str, Endpoint] = {}
+
+
+def get_endpoint(url: str) -> Endpoint:
+    url = url.rstrip('/')
+    if url not in _endpoints:
+        _endpoints[url] = Endpoint(url)
+    return _endpoints[url]
 
 
 class TronAPI:
     # if you can find the transaction in the solidity node, then the transaction is guaranteed confirmed
-    LAST_BLOCK = f'https://{Config.TRON_HOST}/walletsolidity/getnowblock'
-    BLOCK_BY_NUM_RANGE = f'https://{Config.TRON_HOST}/walletsolidity/getblockbylimitnext'
-    BLOCK_BY_NUM = f'https://{Config.TRON_HOST}/walletsolidity/getblockbynum'
+    LAST_BLOCK = '/walletsolidity/getnowblock'
+    BLOCK_BY_NUM_RANGE = '/walletsolidity/getblockbylimitnext'
+    BLOCK_BY_NUM = '/walletsolidity/getblockbynum'
+    TX_INFO_BY_BLOCK_NUM = '/walletsolidity/gettransactioninfobyblocknum'
+    # Неподтвержденные блоки полной ноды - для быстрого режима сканера
+    HEAD_BLOCK = '/wallet/getnowblock'
+    HEAD_BLOCK_BY_NUM_RANGE = '/wallet/getblockbylimitnext'
+    HEAD_TX_INFO_BY_BLOCK_NUM = '/wallet/gettransactioninfobyblocknum'
+    # Балансы - по последнему состоянию полной ноды
+    ACCOUNT = '/wallet/getaccount'
+    TRIGGER_CONSTANT = '/wallet/triggerconstantcontract'
+    # Нулевой адрес как отправитель view-вызовов
+    ZERO_ADDRESS = to_base58check_address(b'\x41' + bytes(20))
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, endpoints: List[str] = None, hedge: bool = None):
         self.api_key = api_key
+        self.endpoints = [get_endpoint(url) for url in (endpoints or Config.TRON_ENDPOINTS)]
+        self.hedge = Config.TRON_HEDGE if hedge is None else hedge
 
-        headers = {
+        self.headers = {
                 'Content-Type': "application/json",
             }
-
+        self.trongrid_headers = dict(self.headers)
         if api_key:
-            headers.update({'TRON-PRO-API-KEY': api_key})
-        self._client: ClientSession = ClientSession(headers=headers)
+            self.trongrid_headers.update({'TRON-PRO-API-KEY': api_key})
+        self._client: ClientSession = get_session()
 
     async def close_session(self):
-        await self._client.close()
+        # Сессия общая на процесс, закрывается через close_sessions()
+        pass
+
+    async def _send(self, endpoint: Endpoint, method: str, path: str, decode=loads, **kwargs):
+        await rate_limiter.acquire()
+        started = time.monotonic()
+        headers = self.trongrid_headers if endpoint.trongrid else self.headers
+        try:
+            async with self._client.request(method, endpoint.url + path, headers=headers, **kwargs) as resp:
+                resp.raise_for_status()
+                # Разбираем сами из байт, без промежуточного resp.json()
+                res = decode(await resp.read())
+            if isinstance(res, dict) and 'Error' in res:
+                raise TronAPIError(res['Error'])
+        except Exception as e:
+            endpoint.record_error()
+            NODE_REQUEST_ERRORS.labels(endpoint.url, path).inc()
+            logger.warning(f'{endpoint.url}{path} error: {e!r}')
+            raise
+        latency = time.monotonic() - started
+        endpoint.record_success(latency)
+        NODE_REQUEST_SECONDS.labels(endpoint.url, path).observe(latency)
+        return res
+
+    async def _request(self, method: str, path: str, hedge: bool = False, decode=loads, **kwargs):
+        """
+        Запрос на самую здоровую ноду, при ошибке - на следующую.
+        С hedge=True, если нода не ответила за свой p95, дублируем запрос на следующую
+        и берем первый успешный ответ
+        """
+        remaining = sorted(self.endpoints, key=lambda e: e.score)
+        error = None
+        while remaining:
+            primary = remaining.pop(0)
+            launched = time.monotonic()
+            first = asyncio.ensure_future(self._send(primary, method, path, decode, **kwargs))
+            attempts = {first}
+            try:
+                if hedge and remaining:
+                    done, _ = await asyncio.wait(attempts, timeout=primary.hedge_delay)
+                    if not done:
+                        attempts.add(asyncio.ensure_future(self._send(remaining.pop(0), method, path, decode, **kwargs)))
+
+                while attempts:
+                    done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        if task.exception() is None:
+                            # Отмененный дубль и отмена снаружи в статистику не идут
+                            if first in attempts:
+                                primary.record_lost_hedge(time.monotonic() - launched)
+                            return task.result()
+                        error = task.exception()
+            finally:
+                for task in attempts:
+                    task.cancel()
+        raise error or TronAPIError('no endpoints')
 
     async def _get_request(self, path, params=None):
-        async with self._client.get(path, params=params) as resp:
-            return await resp.json()
+        return await self._request('GET', path, params=params)
 
-    async def _post_request(self, path, json_data=None):
-        async with self._client.post(path, json=json_data) as resp:
-            return await resp.json()
+    async def _post_request(self, path, json_data=None, hedge=False, decode=loads):
+        return await self._request('POST', path, hedge=hedge, decode=decode, json=json_data)
 
-    async def get_last_block_num(self) -> int:
+    async def get_now_block(self, confirmed: bool = True) -> BlockRecord:
+        """
+        Последний блок solidity-ноды, с confirmed=False - полной ноды (еще может уйти в форк)
+        """
+        path = self.LAST_BLOCK if confirmed else self.HEAD_BLOCK
+        delay = 1
         while True:
             try:
-                print(self.LAST_BLOCK)
-                res = await self._get_request(self.LAST_BLOCK)
-                return res['block_header']['raw_data']['number']
-            except Exception:
-                await asyncio.sleep(10)
-
-    async def get_block_by_num(self, num: int) -> dict:
-        res = await self._post_request(self.BLOCK_BY_NUM, json_data={"num": num})
-        return res
+                block = await self._request('GET', path, decode=decode_block)
+                if block is None:
+                    raise TronAPIError('empty block')
+                return block
+            except Exception as e:
+                logger.warning(f'All endpoints failed on {path}: {e!r}')
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
 
-    async def get_blocks_by_num_range(self, num: int, num_range=5) -> list:
+    async def get_last_block_num(self) -> int:
+        return (await self.get_now_block()).num
+
+    async def get_block_by_num(self, num: int) -> Optional[BlockRecord]:
+        return await self._post_request(self.BLOCK_BY_NUM, json_data={"num": num}, decode=decode_block)
+
+    async def get_blocks_by_num_range(self, num: int, num_range=5) -> List[BlockRecord]:
         """
         Returns the list of Block Objects included in the 'Block Height' range specified. (Confirmed state)
         """
-        res = await self._post_request(self.BLOCK_BY_NUM_RANGE, json_data={"startNum": num, "endNum": num + num_range})
-        return res.get('block')
+        return await self._post_request(self.BLOCK_BY_NUM_RANGE, json_data={"startNum": num, "endNum": num + num_range},
+                                        hedge=self.hedge, decode=decode_blocks)
+
+    async def get_blocks_raw(self, num: int, num_range=5, confirmed: bool = True) -> bytes:
+        """
+        Тот же getblockbylimitnext, но сырые байты ответа - для разбора в ParsePool.
+        confirmed=False - с полной ноды, включая еще не подтвержденные блоки
+        """
+        path = self.BLOCK_BY_NUM_RANGE if confirmed else self.HEAD_BLOCK_BY_NUM_RANGE
+        return await self._post_request(path, json_data={"startNum": num, "endNum": num + num_range},
+                                        hedge=self.hedge, decode=check_response)
+
+    async def get_transaction_infos(self, num: int, confirmed: bool = True) -> Dict[str, TxInfoRecord]:
+        """
+        Квитанции всех транзакций блока одним запросом: комиссия, энергия и результат исполнения
+        """
+        path = self.TX_INFO_BY_BLOCK_NUM if confirmed else self.HEAD_TX_INFO_BY_BLOCK_NUM
+        return await self._post_request(path, json_data={'num': num}, hedge=self.hedge,
+                                        decode=decode_transaction_infos)
+
+    async def get_account_balance(self, address: str) -> int:
+        """
+        Баланс TRX в sun, у неактивированного аккаунта нода отдает {}
+        """
+        res = await self._post_request(self.ACCOUNT, json_data={'address': address, 'visible': True})
+        return res.get('balance', 0)
+
+    async def trigger_constant(self, contract_address: str, function_selector: str, parameter: str = '',
+                               owner_address: str = None) -> bytes:
+        """
+        Вызов view-функции контракта, возвращает сырой результат
+        """
+        res = await self._post_request(self.TRIGGER_CONSTANT, json_data={
+            'owner_address': owner_address or self.ZERO_ADDRESS,
+            'contract_address': contract_address,
+            'function_selector': function_selector,
+            'parameter': parameter,
+            'visible': True,
+        })
+        result = res.get('result') or {}
+        if not result.get('result') or not res.get('constant_result'):
+            raise TronAPIError(f'{function_selector} on {contract_address} failed: {result.get("message")}')
+        return bytes.fromhex(res['constant_result'][0])
 
     async def __aenter__(self):
         return self
@@ -61,11 +332,26 @@ class TronAPI:
         await self.close_session()
 
 
+class _RateLimitedHTTPProvider(AsyncHTTPProvider):
+
+    async def make_request(self, method, params=None):
+        await rate_limiter.acquire()
+        return await super().make_request(method, params)
+
+
 class TronClient(AsyncTron):
 
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, network=Config.NETWORK, **kwargs)
-        self.provider = AsyncHTTPProvider(api_key=Config.API_KEY, endpoint_uri=Config.TRON_NODE)
+        provider = _RateLimitedHTTPProvider(
+            api_key=Config.API_KEY, endpoint_uri=Config.TRON_NODE, client=get_httpx_client())
+        super().__init__(provider, *args, network=Config.NETWORK, **kwargs)
+
+    async def close(self):
+        # httpx-клиент общий на процесс, закрывается через close_sessions()
+        pass
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
 
 
 async def send_trc20(from_address: str, to_address: str, amount: int, private_key: str, contract_address):
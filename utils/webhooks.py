@@ -0,0 +1,237 @@
+"""
+Вебхуки о новых транзакциях (deposit, withdraw, transfer) через transactional outbox.
+Откатившиеся по квитанции (failed) не отправляются - средства не переведены,
+транзакции неподтвержденного блока (pending) - только после его подтверждения.
+
+Сканер пишет событие в webhook_outbox той же транзакцией, что и саму
+Transaction, поэтому событие не теряется и не появляется без депозита.
+WebhookDispatcher забирает пачки через FOR UPDATE SKIP LOCKED (можно
+запускать несколько) и сразу коммитит аренду - сдвигает next_attempt_at
+на время отправки пачки. Отправляет вне транзакции, параллельно с
+ограничением, результаты пишет второй короткой транзакцией; при ошибке
+откладывает с экспоненциальной задержкой и jitter. Если диспетчер упал
+посреди отправки, пачку после аренды заберет другой.
+
+Тело подписывается HMAC-SHA256 от "<timestamp>.<body>" секретом WEBHOOK_SECRET:
+
+    X-Webhook-Timestamp: 1700000000
+    X-Webhook-Signature: sha256=<hex>
+    Idempotency-Key: <purpose>:<txid>
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from models import WebhookOutbox
+from settings import Config
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном INSERT в outbox
+OUTBOX_INSERT_BATCH_SIZE = 1000
+
+
+def transaction_event(tx_id: int, row: dict) -> dict:
+    """
+    Событие по строке, которую сканер вставил в transactions
+    """
+    return {
+        'event': row['purpose'],
+        'id': tx_id,
+        'txid': row['txid'],
+        'block_num': row['block_num'],
+        'contract_address': row['contract_address'],
+        'currency_name': row['currency_name'],
+        'from_address': row['from_address'],
+        'to_address': row['to_address'],
+        'amount': str(row['amount']),
+        'purpose': row['purpose'],
+        'status': row['status'],
+        'time': row['time'].isoformat() if row['time'] is not None else None,
+    }
+
+
+async def add_to_outbox(session: AsyncSession, events: List[dict]):
+    """
+    В транзакции сканера, до commit
+    """
+    now = datetime.utcnow()
+    rows = [
+        dict(transaction_id=event['id'], idempotency_key=f"{event['event']}:{event['txid']}",
+             payload=json.dumps(event), attempts=0, next_attempt_at=now, created=now)
+        for event in events
+    ]
+    for i in range(0, len(rows), OUTBOX_INSERT_BATCH_SIZE):
+        await session.execute(insert(WebhookOutbox).values(rows[i:i + OUTBOX_INSERT_BATCH_SIZE])
+                              .on_conflict_do_nothing(index_elements=[WebhookOutbox.idempotency_key]))
+
+
+def sign(secret: str, timestamp: str, body: bytes) -> str:
+    mac = hmac.new(secret.encode(), timestamp.encode() + b'.' + body, hashlib.sha256)
+    return 'sha256=' + mac.hexdigest()
+
+
+class WebhookDispatcher:
+
+    def __init__(self, engine, url: str = None, secret: str = None, batch_size: int = None,
+                 concurrency: int = None):
+        self.engine = engine
+        self.url = url or Config.WEBHOOK_URL
+        self.secret = Config.WEBHOOK_SECRET if secret is None else secret
+        self.batch_size = batch_size or Config.WEBHOOK_BATCH_SIZE
+        self.concurrency = concurrency or Config.WEBHOOK_CONCURRENCY
+        self._semaphore = None
+        self._wakeup = None
+        self._session: Optional[ClientSession] = None
+        self._task = None
+
+    def touch(self, new_txs: list):
+        """
+        Слушатель сканера - после коммита в outbox есть новые события
+        """
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._wakeup = asyncio.Event()
+        self._session = ClientSession(
+            connector=TCPConnector(limit=self.concurrency),
+            timeout=ClientTimeout(total=Config.WEBHOOK_TIMEOUT),
+        )
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._session is not None:
+            await self._session.close()
+
+    async def _run(self):
+        while True:
+            try:
+                sent = await self.dispatch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f'Webhook dispatch error: {e}')
+                sent = 0
+
+            # Полная пачка - сразу за следующей, иначе ждем сканер или отложенные повторы
+            if sent < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), Config.WEBHOOK_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def dispatch(self) -> int:
+        """
+        Одна пачка: аренда строк коммитится до отправки, блокировки не держатся на время HTTP
+        """
+        rows = await self._claim()
+        if not rows:
+            return 0
+
+        errors = await asyncio.gather(*(self._deliver(row.idempotency_key, row.payload) for row in rows))
+
+        now = datetime.utcnow()
+        delivered = [row.id for row, error in zip(rows, errors) if error is None]
+        failed = [
+            {'_id': row.id, 'attempts': row.attempts + 1, 'last_error': error[:256],
+             'next_attempt_at': now + timedelta(seconds=self._backoff(row.attempts + 1))}
+            for row, error in zip(rows, errors) if error is not None
+        ]
+
+        outbox = WebhookOutbox.__table__
+        async with AsyncSession(bind=self.engine) as session:
+            if delivered:
+                await session.execute(
+                    update(outbox).where(outbox.c.id.in_(delivered))
+                    .values(delivered_at=now, attempts=outbox.c.attempts + 1, last_error=None)
+                )
+            if failed:
+                # executemany - у каждой строки своя задержка
+                await session.execute(
+                    update(outbox).where(outbox.c.id == bindparam('_id')).values(
+                        attempts=bindparam('attempts'), last_error=bindparam('last_error'),
+                        next_attempt_at=bindparam('next_attempt_at'),
+                    ),
+                    failed,
+                )
+            await session.commit()
+
+        if failed:
+            logger.warning(f'Webhooks: {len(delivered)} delivered, {len(failed)} postponed ({failed[0]["last_error"]})')
+        return len(rows)
+
+    async def _claim(self) -> list:
+        """
+        Забирает пачку и сдвигает next_attempt_at на время ее отправки: пока аренда не истекла,
+        другие диспетчеры строки не видят, а блокировки снимаются сразу коммитом
+        """
+        async with AsyncSession(bind=self.engine) as session:
+            rows = (await session.execute(
+                select(WebhookOutbox.id, WebhookOutbox.idempotency_key, WebhookOutbox.payload, WebhookOutbox.attempts)
+                .where(WebhookOutbox.delivered_at.is_(None), WebhookOutbox.next_attempt_at <= datetime.utcnow())
+                .order_by(WebhookOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rows:
+                return []
+
+            # Запросы идут волнами по concurrency, каждый не дольше WEBHOOK_TIMEOUT, плюс запас на одну волну
+            lease = Config.WEBHOOK_TIMEOUT * (math.ceil(len(rows) / self.concurrency) + 1)
+            await session.execute(
+                update(WebhookOutbox.__table__).where(WebhookOutbox.__table__.c.id.in_([row.id for row in rows]))
+                .values(next_attempt_at=datetime.utcnow() + timedelta(seconds=lease))
+            )
+            await session.commit()
+        return rows
+
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        delay = min(Config.WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1), Config.WEBHOOK_BACKOFF_MAX)
+        # jitter, чтобы после падения получателя повторы не шли одной волной
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _deliver(self, idempotency_key: str, payload: str) -> Optional[str]:
+        """
+        None если получатель ответил 2xx, иначе текст ошибки
+        """
+        body = payload.encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': idempotency_key,
+            'X-Webhook-Timestamp': timestamp,
+        }
+        if self.secret:
+            headers['X-Webhook-Signature'] = sign(self.secret, timestamp, body)
+
+        async with self._semaphore:
+            try:
+                async with self._session.post(self.url, data=body, headers=headers) as resp:
+                    if 200 <= resp.status < 300:
+                        return None
+                    return f'HTTP {resp.status}: {(await resp.text())[:200]}'
+            except Exception as e:
+                return repr(e)